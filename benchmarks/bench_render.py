@@ -0,0 +1,219 @@
+"""
+Headless benchmarks for slice rendering and frame encoding.
+
+Drives DicomSlicer and the viewers directly (no Jupyter frontend) on synthetic volumes
+and writes one JSON record per case, so runs from different commits can be compared:
+
+    python benchmarks/bench_render.py --out before.json
+    python benchmarks/bench_render.py --out after.json
+    python benchmarks/bench_render.py --compare before.json after.json
+
+`--profile full` sweeps 256^2..2048^2 slices, 100..1000 slices deep, int16/float32 and
+4..64 labels; configurations larger than `--max-mem` are skipped.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import PIL
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dicom_utils.dicom_utils import DicomSlicer, palette_16  # noqa: E402
+from dicom_utils.viewers import SimpleImageViewer, EncodingPolicy  # noqa: E402
+
+PROFILES = {
+    'quick': dict(sizes=[256, 512], depths=[100], dtypes=['int16'], labels=[16]),
+    'default': dict(sizes=[256, 512, 1024], depths=[100], dtypes=['int16', 'float32'], labels=[4, 16]),
+    'full': dict(sizes=[256, 512, 1024, 2048], depths=[100, 1000], dtypes=['int16', 'float32'], labels=[4, 16, 64]),
+}
+
+ENCODERS = {
+    'webp_q90': EncodingPolicy.fixed('webp', quality=90),
+    'webp_q60_m0': EncodingPolicy.fixed('webp', quality=60, method=0),
+    'jpeg_q70': EncodingPolicy.fixed('jpeg', quality=70),
+    'png': EncodingPolicy.fixed('png', quality=90, compress_level=1),
+}
+
+
+def synthetic_case(size, depth, dtype, n_labels, seed=0):
+    """CT-like volume (smooth structures + noise, roughly -1000..1500 HU) and a blob label map."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[:size, :size].astype(np.float32) / size
+    img = np.empty((depth, size, size), dtype=dtype)
+    mask = np.empty((depth, size, size), dtype=np.uint8)
+    r = np.hypot(x - 0.5, y - 0.5)
+    noise = rng.normal(0, 25, (size, size)).astype(np.float32)
+    for z in range(depth):
+        t = z / max(depth - 1, 1)
+        body = np.where(r < 0.42, 40.0, -1000.0)
+        organs = 800 * np.sin(9 * x + 3 * t) * np.cos(7 * y - 2 * t)
+        img[z] = (body + np.where(r < 0.42, organs, 0) + np.roll(noise, z, axis=0)).astype(dtype)
+        # Labels: angular sectors inside the body, rotating with z
+        angle = (np.arctan2(y - 0.5, x - 0.5) + np.pi + t) % (2 * np.pi)
+        mask[z] = np.where(r < 0.4, 1 + (angle / (2 * np.pi) * n_labels).astype(np.uint8) % n_labels, 0)
+    return img, mask
+
+
+def label_mapping(n_labels):
+    """(label_to_organ, organ_to_color) colouring labels 1..n_labels, cycling the 16-colour palette."""
+    label_to_organ = {i: f'label{i}' for i in range(1, n_labels + 1)}
+    organ_to_color = {f'label{i}': palette_16[(i - 1) % len(palette_16)] for i in range(1, n_labels + 1)}
+    return label_to_organ, organ_to_color
+
+
+def make_slicer(img, mask, params):
+    label_to_organ, organ_to_color = label_mapping(params['labels'])
+    return DicomSlicer(img, mask=mask, label_to_organ=label_to_organ, organ_to_color=organ_to_color)
+
+
+def _timed_frames(fn, n):
+    times = np.empty(n)
+    for i in range(n):
+        t0 = time.perf_counter()
+        fn(i)
+        times[i] = time.perf_counter() - t0
+    return times
+
+
+def _record(name, params, times):
+    ms = times * 1000
+    return dict(case=name, **params, frames=int(len(times)),
+                total_s=float(times.sum()), mean_ms=float(ms.mean()),
+                p50_ms=float(np.percentile(ms, 50)), p95_ms=float(np.percentile(ms, 95)),
+                fps=float(len(times) / times.sum()) if times.sum() > 0 else 0.0)
+
+
+def bench_case(img, mask, params, frames):
+    slicer = make_slicer(img, mask, params)
+    depth = img.shape[0]
+    n = min(frames, depth)
+    out = []
+
+    modes = {
+        'scroll_mask_off': dict(mask_on=False, only_mask=False),
+        'scroll_mask_on': dict(mask_on=True, only_mask=False),
+        'scroll_only_mask': dict(mask_on=True, only_mask=True),
+    }
+    for name, st in modes.items():
+        slicer.update_state(hu=(-130, 600), **st)
+        times = _timed_frames(lambda i: (slicer.update_state(z_index=i % depth), slicer.get_image()), n)
+        out.append(_record(name, params, times))
+
+    for mask_on in (False, True):
+        slicer.update_state(z_index=depth // 2, mask_on=mask_on, only_mask=False)
+        times = _timed_frames(lambda i: (slicer.update_state(hu=(-130 + 3 * i, 600 + 5 * i)), slicer.get_image()), n)
+        out.append(_record('window_sweep_mask_on' if mask_on else 'window_sweep', params, times))
+
+    slicer.update_state(z_index=depth // 2, hu=(-130, 600), mask_on=True, only_mask=False)
+    pil_img = slicer.get_image()
+    for enc_name, policy in ENCODERS.items():
+        viewer = SimpleImageViewer(width=pil_img.width, height=pil_img.height, encoding=policy)
+        n_enc = max(3, n // 10)
+        times = _timed_frames(lambda i: viewer.set_image(pil_img), n_enc)
+        out.append(_record(f'encode_{enc_name}', params, times))
+
+    return out
+
+
+def bench_animation(img, mask, params, n_frames):
+    slicer = make_slicer(img, mask, params)
+    slicer.update_state(mask_on=True)
+    with tempfile.TemporaryDirectory() as d:
+        fn = os.path.join(d, 'anim.webp')
+        n = min(n_frames, img.shape[0])
+        t0 = time.perf_counter()
+        slicer.save_animation(fn, z_lst=range(n))
+        dt = time.perf_counter() - t0
+    # Only the total is observable; report it as n equal frames
+    return _record('save_animation', params, np.full(n, dt / n))
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return dict(commit=commit, python=platform.python_version(), numpy=np.__version__,
+                pillow=PIL.__version__, machine=platform.machine(), cpus=os.cpu_count())
+
+
+def run(args):
+    prof = PROFILES[args.profile]
+    sizes = args.sizes or prof['sizes']
+    depths = args.depths or prof['depths']
+    dtypes = args.dtypes or prof['dtypes']
+    labels = args.labels or prof['labels']
+    env = environment()
+    records = []
+    for size in sizes:
+        for depth in depths:
+            for dtype in dtypes:
+                nbytes = depth * size * size * (np.dtype(dtype).itemsize + 1)
+                if nbytes > args.max_mem * 2**20:
+                    print(f'skip {size}^2 x {depth} {dtype}: {nbytes / 2**20:.0f} MB > --max-mem', file=sys.stderr)
+                    continue
+                for n_labels in labels:
+                    params = dict(size=size, depth=depth, dtype=dtype, labels=n_labels)
+                    img, mask = synthetic_case(size, depth, dtype, n_labels)
+                    recs = bench_case(img, mask, params, args.frames)
+                    if args.animation:
+                        recs.append(bench_animation(img, mask, params, args.animation))
+                    for rec in recs:
+                        rec['env'] = env
+                        print(f"{rec['case']:<24} {size:>5}^2 x{depth:<5} {dtype:<8} L={n_labels:<3} "
+                              f"p50 {rec['p50_ms']:8.2f} ms  p95 {rec['p95_ms']:8.2f} ms  {rec['fps']:7.1f} fps",
+                              file=sys.stderr)
+                    records.extend(recs)
+                    del img, mask
+    return records
+
+
+def _key(rec):
+    return (rec['case'], rec['size'], rec['depth'], rec['dtype'], rec['labels'])
+
+
+def compare(old_fn, new_fn):
+    load = lambda fn: {_key(r): r for r in map(json.loads, open(fn))}
+    old, new = load(old_fn), load(new_fn)
+    print(f"{'case':<24} {'size':>5} {'depth':>5} {'dtype':<8} {'L':>3} {'old p50':>10} {'new p50':>10} {'speedup':>8}")
+    for key in sorted(set(old) & set(new), key=str):
+        o, n = old[key]['p50_ms'], new[key]['p50_ms']
+        print(f"{key[0]:<24} {key[1]:>5} {key[2]:>5} {key[3]:<8} {key[4]:>3} {o:10.2f} {n:10.2f} {o / n if n else float('inf'):8.2f}x")
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--profile', choices=sorted(PROFILES), default='quick')
+    p.add_argument('--sizes', type=lambda s: [int(v) for v in s.split(',')])
+    p.add_argument('--depths', type=lambda s: [int(v) for v in s.split(',')])
+    p.add_argument('--dtypes', type=lambda s: s.split(','))
+    p.add_argument('--labels', type=lambda s: [int(v) for v in s.split(',')])
+    p.add_argument('--frames', type=int, default=50, help='frames per scroll/window sweep')
+    p.add_argument('--animation', type=int, default=20, help='frames in the save_animation case (0: skip)')
+    p.add_argument('--max-mem', type=int, default=2048, help='skip volumes larger than this (MB)')
+    p.add_argument('--out', help='write JSON lines here (default: stdout)')
+    p.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files and exit')
+    args = p.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    records = run(args)
+    lines = '\n'.join(json.dumps(r) for r in records) + '\n'
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(lines)
+    else:
+        sys.stdout.write(lines)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,15 @@
 # dicom_utils package
 from .dicom_utils import DicomWidget, DicomSlicer, wl2range
 from .canvas_utils import AnnotationCanvas, WindowMeta, UICanvas
-from .base_widgets import SimpleRGBWidget
+from .base_widgets import SimpleRGBWidget, PyramidWidget, MPRWidget
+from .mpr import MPRSlicer
+from .cpr import CPRSlicer
+from .ndslicer import NDSlicer
+from .pyramid import ImagePyramid, PyramidSlicer, TileCache
 from .interactive_slicer import InteractiveViewer,InteractiveSlicer
+from .frame_cache import FrameCache
+from .prefetch import SlicePrefetcher
+from .viewers import EncodingPolicy
+from .scheduler import RenderScheduler
+from .profiling import StageTimer
+from .sources import VolumeSource, SliceDirectorySource, ChunkedSource, open_volume
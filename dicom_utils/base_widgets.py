@@ -2,6 +2,15 @@ import ipywidgets as widgets
 import numpy as np
 from PIL import Image
 import io
+from contextlib import nullcontext
+
+from .canvas_utils import UICanvas
+from .frame_cache import render_encoded, show_frame
+from .mpr import MPRSlicer, PLANE_AXES, PLANE_INDEX
+from .pyramid import PyramidSlicer
+from .scheduler import RenderScheduler
+from .viewers import SimpleImageViewer
+from .viewport import Viewport
 
 class SimpleRGBWidget:
     """
@@ -61,3 +70,201 @@ class SimpleRGBWidget:
     def display(self):
         from IPython.display import display
         display(self.widget)
+
+
+class PyramidWidget:
+    """
+    Viewer for very large 2D images backed by a PyramidSlicer, with the same `slicer`/`im_w`
+    interface as SimpleRGBWidget so AnnotationCanvas can paint on it:
+
+        w = PyramidWidget(ImagePyramid.load('slide.pyr'))
+        canvas = AnnotationCanvas(w)
+        w.zoom(4, x, y); w.pan(dx, dy); w.reset_view()
+
+    With `progressive=True`, a frame whose tiles are not cached yet is first shown from the
+    finest level that is (at worst the in-memory overview); the full-resolution frame follows
+    from a background thread, unless the view has moved on meanwhile. Ctrl+wheel zooms and a
+    middle-button drag pans when ipyevents is installed.
+    """
+    def __init__(self, image, mask=None, tile_size=256, cache_bytes=256 * 2**20, max_display=1024,
+                 label_to_organ=None, organ_to_color=None, encoding=None, progressive=True, events=True):
+        self.slicer = PyramidSlicer(image, mask=mask, tile_size=tile_size, cache_bytes=cache_bytes,
+                                    max_display=max_display, label_to_organ=label_to_organ,
+                                    organ_to_color=organ_to_color)
+        self.slicer.update_state(mask_on=mask is not None)
+        dh, dw = self.slicer.display_size
+        self.viewport = Viewport(self.slicer.img.shape[1:3], (dh, dw))
+        self.viewer = SimpleImageViewer(width=dw, height=dh, encoding=encoding)
+        self.im_w = self.viewer.image_widget
+        self.scheduler = RenderScheduler(self._show) if progressive else None
+
+        # Dummy controls (required by AnnotationCanvas, which reads and sets them)
+        self.hu = widgets.IntRangeSlider(min=0, max=255, value=(0, 255))
+        self.z_index = widgets.IntSlider(min=0, max=0, value=0)
+
+        self.widget = widgets.Box([self.im_w])
+        self._events = self._bind_events() if events else None
+        self._pan_last = None
+        self._render()
+
+    def _bind_events(self):
+        try:
+            from ipyevents import Event
+        except ImportError:
+            return None
+        events = Event(source=self.im_w, watched_events=['wheel', 'mousedown', 'mousemove', 'mouseup'],
+                       prevent_default_action=True)
+        events.on_dom_event(self._handle_event)
+        return events
+
+    def _handle_event(self, event):
+        etype = event['type']
+        if etype == 'wheel' and (event.get('ctrlKey') or event.get('metaKey')):
+            self.zoom(1.25 if event.get('deltaY', 0) < 0 else 0.8, event.get('dataX'), event.get('dataY'))
+        elif etype == 'mousedown' and event.get('button') == 1:
+            self._pan_last = (event.get('dataX', 0), event.get('dataY', 0))
+        elif etype == 'mousemove' and self._pan_last is not None:
+            x, y = event.get('dataX', 0), event.get('dataY', 0)
+            self.pan(x - self._pan_last[0], y - self._pan_last[1])
+            self._pan_last = (x, y)
+        elif etype == 'mouseup':
+            self._pan_last = None
+
+    # --- AnnotationCanvas interface ---
+    def ignore_updates(self):
+        return nullcontext()
+
+    def set_widget_value(self, widget_obj, new_val):
+        widget_obj.value = new_val
+
+    def _update_image(self, z_index, hu, mask_opacity=None, mask_on=None, only_mask=None, interactive=False):
+        state = {'z_index': 0, 'hu': hu, 'mask_opacity': mask_opacity, 'mask_on': mask_on, 'only_mask': only_mask}
+        self.slicer.update_state(**{k: v for k, v in state.items() if v is not None})
+        self._render(interactive=interactive)
+
+    # --- Rendering ---
+    def _render(self, interactive=False):
+        state = dict(self.slicer.state)
+        if self.scheduler is not None:
+            ready = self.slicer.ready_level(state)
+            if ready != self.slicer.level_for(state):
+                # Overview from cached tiles now, full resolution once its tiles are read
+                self.viewer.set_image(self.slicer.get_image(state, level=ready), interactive=True)
+                self.scheduler.request(state, interactive)
+                return
+        self._show(state, interactive)
+
+    def _show(self, state, interactive):
+        if state != self.slicer.state:
+            return  # superseded by a newer view
+        data, is_interactive = render_encoded(self.slicer, self.viewer, state, interactive=interactive)
+        if state != self.slicer.state:
+            return
+        refresh = (lambda: render_encoded(self.slicer, self.viewer, state)[0]) if is_interactive else None
+        self.viewer.set_encoded(data, is_interactive, refresh)
+
+    def _apply_viewport(self, interactive=True):
+        self.slicer.update_state(viewport=self.viewport.state())
+        self._render(interactive=interactive)
+
+    def zoom(self, factor, x=None, y=None):
+        """Multiply the zoom by `factor`, keeping display point (x, y) (default: the centre) in place."""
+        self.viewport.zoom_at(factor, x, y)
+        self._apply_viewport()
+
+    def pan(self, dx, dy):
+        """Move the view with a drag of (dx, dy) display pixels."""
+        self.viewport.pan(dx, dy)
+        self._apply_viewport()
+
+    def reset_view(self):
+        self.viewport.reset()
+        self._apply_viewport(interactive=False)
+
+    def undo(self):
+        if self.slicer.undo():
+            self._render()
+
+    def redo(self):
+        if self.slicer.redo():
+            self._render()
+
+    def display(self):
+        from IPython.display import display
+        display(self.widget)
+
+
+class MPRWidget:
+    """
+    Axial, coronal and sagittal views of a volume in one image, driven by a single UICanvas:
+
+        w = MPRWidget(ct, mask, spacing=(2.5, 0.7, 0.7))
+        w.canvas().display()
+
+    Wheel scrolls the plane under the mouse, left click/drag moves the crosshair (and with it
+    the slices of the other planes), right drag changes window/level.
+    """
+    def __init__(self, image_array, mask=None, spacing=None, label_to_organ=None, organ_to_color=None,
+                 planes=('axial', 'coronal', 'sagittal'), encoding=None, async_render=True, **slicer_kwargs):
+        self.slicer = MPRSlicer(image_array, mask=mask, spacing=spacing, label_to_organ=label_to_organ,
+                                organ_to_color=organ_to_color, planes=planes, **slicer_kwargs)
+        self.slicer.update_state(mask_on=mask is not None)
+        self.meta = self.slicer.layout()
+        self.viewer = SimpleImageViewer(width=self.meta.width, height=self.meta.height, encoding=encoding)
+        self.im_w = self.viewer.image_widget
+        self.widget = widgets.Box([self.im_w])
+        self.scheduler = RenderScheduler(self._show) if async_render else None
+        self.wl_sens = 1
+        self._render()
+
+    def canvas(self, throttle_rate=50):
+        """UICanvas over the frame, with events routed to `handle_event`."""
+        return UICanvas(self, self.meta, self.handle_event, throttle_rate=throttle_rate)
+
+    def _show(self, state, interactive):
+        show_frame(self.slicer, self.viewer, interactive=interactive, state=state)
+
+    def _render(self, interactive=False):
+        if self.scheduler is not None:
+            self.scheduler.request(self.slicer.state, interactive)
+        else:
+            self._show(dict(self.slicer.state), interactive)
+
+    def _update_image(self, z_index, hu, mask_opacity=None, mask_on=None, only_mask=None, interactive=False):
+        state = {'z_index': z_index, 'hu': hu, 'mask_opacity': mask_opacity, 'mask_on': mask_on, 'only_mask': only_mask}
+        self.slicer.update_state(**{k: v for k, v in state.items() if v is not None})
+        self._render(interactive=interactive)
+
+    def scroll(self, plane, step):
+        """Move `plane` by `step` slices."""
+        key = PLANE_INDEX[plane]
+        n = self.slicer.img.shape[PLANE_AXES[plane][0]]
+        self.slicer.update_state(**{key: min(max(self.slicer.state[key] + step, 0), n - 1)})
+
+    def set_point(self, z, y, x):
+        """Show the planes through voxel (z, y, x)."""
+        self.slicer.update_state(z_index=int(z), y_index=int(y), x_index=int(x))
+
+    def handle_event(self, message):
+        """UICanvas callback."""
+        plane = self.slicer.plane_of(message['planeId'])
+        if plane is None:
+            return
+        etype = message['eventType']
+        button = message.get('mouseButton')
+        if etype == 'mouse_wheel':
+            self.scroll(plane, int(message.get('deltaY') or 0))
+        elif etype in ('click', 'drag_start', 'drag_move') and button == 0:
+            self.set_point(*self.slicer.voxel_at(plane, message['x'], message['y']))
+        elif etype == 'drag_move' and button == 2:
+            s = self.wl_sens
+            dx, dy = message.get('dx') or 0, message.get('dy') or 0
+            a, b = self.slicer.state['hu']
+            self.slicer.update_state(hu=(int(a + s*dx - s*dy), int(b + s*dx + s*dy)))
+        else:
+            return
+        self._render(interactive=etype != 'click')
+
+    def display(self):
+        from IPython.display import display
+        display(self.widget)
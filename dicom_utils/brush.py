@@ -0,0 +1,42 @@
+"""
+Brush rasterisation for mask painting.
+
+A stroke segment is every pixel whose centre lies within `radius` of the line segment
+between two (y, x) positions, so consecutive (throttled) mouse positions join into a
+continuous stroke. Radius 0 draws a one pixel wide line.
+"""
+import numpy as np
+
+
+def segment_pixels(p0, p1, radius, shape):
+    """
+    Indices (ys, xs) of the pixels of an image of `shape` (height, width) within `radius`
+    of the segment p0-p1 (both (y, x)). Computed in one vectorised pass over the segment's
+    bounding box; pixels outside the image are dropped.
+    """
+    r = max(float(radius), 0.5)
+    (y0, x0), (y1, x1) = p0, p1
+    top = max(int(np.floor(min(y0, y1) - r)), 0)
+    bottom = min(int(np.ceil(max(y0, y1) + r)) + 1, shape[0])
+    left = max(int(np.floor(min(x0, x1) - r)), 0)
+    right = min(int(np.ceil(max(x0, x1) + r)) + 1, shape[1])
+    if top >= bottom or left >= right:
+        empty = np.empty(0, dtype=np.intp)
+        return empty, empty
+
+    ys, xs = np.ogrid[top:bottom, left:right]
+    dy, dx = y1 - y0, x1 - x0
+    length2 = dy * dy + dx * dx
+    if length2 == 0:
+        t = 0.0
+    else:
+        # Projection of each pixel onto the segment, clamped to its end points
+        t = np.clip(((ys - y0) * dy + (xs - x0) * dx) / length2, 0.0, 1.0)
+    dist2 = (ys - (y0 + t * dy)) ** 2 + (xs - (x0 + t * dx)) ** 2
+    iy, ix = np.nonzero(dist2 <= r * r)
+    return iy + top, ix + left
+
+
+def disc_pixels(center, radius, shape):
+    """Indices (ys, xs) of a filled disc around `center` (y, x)."""
+    return segment_pixels(center, center, radius, shape)
@@ -8,6 +8,9 @@ from dataclasses import dataclass
 
 from contextlib import contextmanager
 
+from .brush import segment_pixels
+from .viewport import display_to_source
+
 @dataclass
 class WindowMeta:
     width: int
@@ -58,7 +61,8 @@ output = Output()
 DATA_LIMITS = (-2000,3000)
 
 class AnnotationCanvas:
-    def __init__(self, dicom_widget, edit_flag=False, on_click_callback=None, fps=5, logger=None):
+    def __init__(self, dicom_widget, edit_flag=False, on_click_callback=None, fps=5, logger=None, preview_size=512,
+                 brush_radius=2, brush_label=4):
 
         self.logger = logger or logging.getLogger(__name__)
         
@@ -68,6 +72,13 @@ class AnnotationCanvas:
         
         self._last_data_pos = None
         self._last_data_pos_btn2 = None
+        # Max side of downsampled W/L drag previews (None: full resolution); only for slicers with a 'lod' state
+        self.preview_size = preview_size
+        self._display_lod = 1  # lod of the last frame pushed by this canvas; dataX/dataY are in its pixels
+        # Ctrl-drag painting: pixels within brush_radius of the stroke get brush_label (0 erases)
+        self.brush_radius = brush_radius
+        self.brush_label = brush_label
+        self._stroke_last = None  # (z, y, x) of the previous stroke event
         
         # UI for feedback
         self.msg = Textarea(
@@ -80,7 +91,7 @@ class AnnotationCanvas:
         # throttle_or_debounce='throttle' ensures events are dropped, not queued.
         self.events_slow = Event(
             source=self.w.im_w, 
-            watched_events=['mousemove','mouseup','click', 'contextmenu','dragstart'],
+            watched_events=['mousemove','mouseup','click', 'contextmenu','dragstart', 'keydown'],
             wait=int(1000/fps),
             prevent_default_action=True
         )
@@ -108,29 +119,113 @@ class AnnotationCanvas:
 
         
     
+    def _to_source(self, event):
+        """Slice pixel (x, y) under the event; dataX/dataY are pixels of the pushed (possibly zoomed or preview) frame."""
+        viewport = self.w.slicer.state.get('viewport')
+        return display_to_source(viewport, int(event.get('dataX', 0)), int(event.get('dataY', 0)), self._display_lod)
+
+    def _mask_edited(self, z):
+        """Tell the slicer (if it supports it) that slice z of the mask changed."""
+        mark = getattr(self.w.slicer, 'mark_mask_edited', None)
+        if mark is not None:
+            mark(z)
+
+    def _paint(self, z, ys, xs, label):
+        """Write `label` into the mask; slicers with `edit_mask` then only repaint the touched region."""
+        edit = getattr(self.w.slicer, 'edit_mask', None)
+        if edit is not None:
+            edit(z, ys, xs, label)
+        else:
+            self.w.slicer.mask[z, ys, xs] = label
+            self._mask_edited(z)
+
+    def _paint_stroke(self, z, y, x):
+        """Paint the segment from the previous stroke position to (y, x) as one mask update."""
+        last = self._stroke_last
+        if last is None:
+            self._history_call('begin')  # the whole stroke is undone at once
+        p0 = last[1:] if last is not None and last[0] == z else (y, x)
+        ys, xs = segment_pixels(p0, (y, x), self.brush_radius, self.w.slicer.mask.shape[1:3])
+        self._paint(z, ys, xs, self.brush_label)
+        self._stroke_last = (z, y, x)
+
+    def _end_stroke(self):
+        if self._stroke_last is not None:
+            self._stroke_last = None
+            self._history_call('end')
+
+    def _history_call(self, name):
+        history = getattr(self.w.slicer, 'history', None)
+        if history is not None:
+            getattr(history, name)()
+
+    def _run_click_callback(self, x, y, z):
+        """Run on_click_callback; its changes to mask slice z are diffed into the undo history."""
+        record = getattr(self.w.slicer, 'record_mask_edit', None)
+        if record is None:
+            self.on_click_callback(x, y, z)
+            self._mask_edited(z)
+            return
+        before = np.array(self.w.slicer.mask[z])
+        self.on_click_callback(x, y, z)
+        record(z, before)
+
+    def undo(self):
+        """Undo the last mask edit (Ctrl+Z on the image)."""
+        if getattr(self.w.slicer, 'undo', None) and self.w.slicer.undo():
+            self._refresh()
+            self.msg.value = "Undo"
+
+    def redo(self):
+        """Redo the last undone mask edit (Ctrl+Y / Ctrl+Shift+Z on the image)."""
+        if getattr(self.w.slicer, 'redo', None) and self.w.slicer.redo():
+            self._refresh()
+            self.msg.value = "Redo"
+
+    def _refresh(self):
+        st = self.w.slicer.state
+        self.w._update_image(st['z_index'], st['hu'], mask_opacity=st['mask_opacity'], mask_on=st['mask_on'],
+                             only_mask=st['only_mask'])
+
+    def _start_preview(self):
+        slicer = self.w.slicer
+        if self.preview_size and 'lod' in slicer.state and self._display_lod == 1:
+            slicer.update_state(lod=slicer.preview_lod(self.preview_size))
+            self._display_lod = slicer.state['lod']
+
+    def _end_preview(self):
+        """Leave W/L preview mode and push the full-resolution frame."""
+        if self._display_lod == 1:
+            return
+        self._display_lod = 1
+        self.w.slicer.update_state(lod=1)
+        self.w._update_image(self.w.slicer.state['z_index'], self.w.slicer.state['hu'], mask_opacity=self.w.slicer.state['mask_opacity'], mask_on=self.w.slicer.state['mask_on'], only_mask=self.w.slicer.state['only_mask'])
+
     @output.capture()
     def _handle_slow(self, event):
       
         etype = event['type']
        
-        x = int(event.get('dataX', 0))
-        y = int(event.get('dataY', 0))
+        x, y = self._to_source(event)
         z = self.w.slicer.state['z_index']
 
         if etype == 'mousemove':
             
           
             if event.get('buttons') == 1 and self.edit_flag and (event.get('ctrlKey') or event.get('metaKey')):
-               self.w.slicer.mask[z,y,x]= 4
+               self._paint_stroke(z, y, x)
                
                hu_val = getattr(self.w, 'hu', None)
                hu_range = hu_val.value if hu_val else None
                
                self.w._update_image(self.w.slicer.state['z_index'], hu_range, \
-                                mask_opacity=self.w.slicer.state['mask_opacity'], mask_on=self.w.slicer.state['mask_on'], only_mask=self.w.slicer.state['only_mask'])
+                                mask_opacity=self.w.slicer.state['mask_opacity'], mask_on=self.w.slicer.state['mask_on'], only_mask=self.w.slicer.state['only_mask'], interactive=True)
         
                   
                 
+            else:
+                self._end_stroke()
+
             if event.get('buttons') == 2:
                 
                 if self._last_data_pos_btn2 is not None:
@@ -163,8 +258,9 @@ class AnnotationCanvas:
                   
                     with self.w.ignore_updates():
                         self.w.set_widget_value(self.w.hu,(new_min,new_max) )
+                    self._start_preview()
 
-                    self.w._update_image( self.w.slicer.state['z_index'], (new_min,new_max) , mask_opacity=self.w.slicer.state['mask_opacity'], mask_on=self.w.slicer.state['mask_on'], only_mask=self.w.slicer.state['only_mask'])
+                    self.w._update_image( self.w.slicer.state['z_index'], (new_min,new_max) , mask_opacity=self.w.slicer.state['mask_opacity'], mask_on=self.w.slicer.state['mask_on'], only_mask=self.w.slicer.state['only_mask'], interactive=True)
 
                 
                 else:
@@ -172,6 +268,7 @@ class AnnotationCanvas:
            
             else:
                 self._last_data_pos_btn2 = None
+                self._end_preview()
    
                 if 0 <= y < self.w.slicer.img.shape[1] and 0 <= x < self.w.slicer.img.shape[2]:
                     hu_val = self.w.slicer.img[z, y, x]
@@ -179,15 +276,25 @@ class AnnotationCanvas:
 
         elif etype == 'mouseup':
             self._last_data_pos_btn2 = None
+            self._end_stroke()
+            self._end_preview()
 
     
+        elif etype == 'keydown':
+            if event.get('ctrlKey') or event.get('metaKey'):
+                key = event.get('key', '')
+                if key == 'z':
+                    self.undo()
+                elif key in ('y', 'Z'):
+                    self.redo()
+
         elif etype == 'contextmenu':
             pass
  
         elif etype == 'click':
             self.msg.value = f"Clicked Data: x={x}, y={y}, slice={z}"
             if self.edit_flag and self.on_click_callback and (event.get('ctrlKey') or event.get('metaKey')):
-                self.on_click_callback(x, y, z)
+                self._run_click_callback(x, y, z)
 
         else:
             pass
@@ -200,8 +307,7 @@ class AnnotationCanvas:
         etype = event['type']
             
           
-        x = int(event.get('dataX', 0))
-        y = int(event.get('dataY', 0))
+        x, y = self._to_source(event)
         
       
 
@@ -222,7 +328,7 @@ class AnnotationCanvas:
             hu_val = getattr(self.w, 'hu', None)
             hu_range = hu_val.value if hu_val else None
                 
-            self.w._update_image( self.z, hu_range , mask_opacity=self.w.slicer.state['mask_opacity'], mask_on=self.w.slicer.state['mask_on'], only_mask=self.w.slicer.state['only_mask'])
+            self.w._update_image( self.z, hu_range , mask_opacity=self.w.slicer.state['mask_opacity'], mask_on=self.w.slicer.state['mask_on'], only_mask=self.w.slicer.state['only_mask'], interactive=True)
 
         elif etype == 'mousemove':
             if event.get('buttons') == 2:
@@ -235,7 +341,7 @@ class AnnotationCanvas:
         elif etype == 'click':
                 self.msg.value = f"Clicked Data: x={x}, y={y}, slice={z}"
                 if self.edit_flag and self.on_click_callback and (event.get('ctrlKey') or event.get('metaKey')):
-                    self.on_click_callback(x, y, z)
+                    self._run_click_callback(x, y, z)
 
 
         
@@ -0,0 +1,208 @@
+"""
+liteviz-render: batch rendering of image/mask volume pairs without Jupyter.
+
+    liteviz-render cases/ -o previews/ --mode animation --mode keyframes --labels saros-regions
+    liteviz-render manifest.csv -o previews/ --mode slices --every 5 --workers 16
+
+Input is a directory or a CSV manifest (columns: id,image[,mask]). In a directory, each
+subdirectory holding `image.npy` (and optionally `mask.npy`) is a case, as is each flat
+`<id>_image.npy` with an optional `<id>_mask.npy`. Volumes are memory-mapped.
+
+Cases are rendered in a process pool. A case is only marked done (`<out>/.done/<id>.json`)
+once all its outputs are written, so an interrupted run resumes where it stopped. The marker
+records the parameters each mode was rendered with: a later run renders only the modes whose
+parameters differ, and replaces their files if the window, labels or mask settings changed.
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from .dicom_utils import DicomSlicer, wl2range
+
+WINDOWS = {
+    'default': (-130, 600),
+    'lung': wl2range(1500, -600),
+    'mediastinum': wl2range(400, 40),
+    'bone': wl2range(1800, 400),
+}
+
+
+def label_scheme(name):
+    """Return (label_to_organ, organ_to_color) for a scheme name, or (None, None) for the default palette."""
+    if name == 'default':
+        return None, None
+    from .label_schemes import saros
+    if name == 'saros-regions':
+        return saros.body_regions_dict, saros.body_regions_colors
+    if name == 'saros-parts':
+        return saros.body_parts_dict, saros.body_parts_colors
+    raise ValueError(f"unknown label scheme {name!r}")
+
+
+def find_cases(source):
+    """List of {'id', 'image', 'mask'} dicts from a directory or a CSV manifest."""
+    if os.path.isfile(source):
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source, newline='') as f:
+            rows = list(csv.DictReader(f))
+        resolve = lambda p: p if not p or os.path.isabs(p) else os.path.join(base, p)
+        return [{'id': r['id'], 'image': resolve(r['image']), 'mask': resolve(r.get('mask') or None)} for r in rows]
+
+    cases = []
+    for fn in sorted(glob.glob(os.path.join(source, '*', 'image.npy'))):
+        d = os.path.dirname(fn)
+        mask = os.path.join(d, 'mask.npy')
+        cases.append({'id': os.path.basename(d), 'image': fn, 'mask': mask if os.path.exists(mask) else None})
+    for fn in sorted(glob.glob(os.path.join(source, '*_image.npy'))):
+        case_id = os.path.basename(fn)[:-len('_image.npy')]
+        mask = os.path.join(source, f'{case_id}_mask.npy')
+        cases.append({'id': case_id, 'image': fn, 'mask': mask if os.path.exists(mask) else None})
+    return cases
+
+
+def _save_png(pil_img, fn):
+    tmp = fn + '.part'
+    pil_img.save(tmp, format='png')
+    os.replace(tmp, fn)
+
+
+def render_case(case, out_dir, modes, hu, labels, mask_opacity=50, only_mask=False, every=1, n_keyframes=5, threads=1,
+                overwrite=False):
+    """
+    Render one case; runs in a worker process. Returns a summary dict.
+    Files are written atomically, so outputs that already exist are complete and skipped, except
+    for the modes in `overwrite` (a set of modes, or True for all).
+    """
+    replace = lambda mode: overwrite is True or (bool(overwrite) and mode in overwrite)
+    t0 = time.perf_counter()
+    label_to_organ, organ_to_color = label_scheme(labels)
+    slicer = DicomSlicer(case['image'], mask=case['mask'],
+                         label_to_organ=label_to_organ, organ_to_color=organ_to_color)
+    has_mask = slicer.mask is not None
+    slicer.update_state(hu=hu, mask_on=has_mask, mask_opacity=mask_opacity, only_mask=only_mask and has_mask)
+    depth = slicer.img.shape[0]
+    z_lst = list(range(0, depth, every))
+    written = []
+
+    fn = os.path.join(out_dir, f"{case['id']}.webp")
+    if 'animation' in modes and (replace('animation') or not os.path.exists(fn)):
+        tmp = fn + '.part'
+        slicer.save_animation(tmp, z_lst=z_lst, workers=threads)
+        os.replace(tmp, fn)
+        written.append(fn)
+
+    if 'slices' in modes or 'keyframes' in modes:
+        case_dir = os.path.join(out_dir, case['id'])
+        os.makedirs(case_dir, exist_ok=True)
+        frames = []
+        if 'slices' in modes:
+            frames += [(z, f'slice_{z:04d}.png', 'slices') for z in z_lst]
+        if 'keyframes' in modes:
+            keys = np.unique(np.linspace(0, depth - 1, n_keyframes).round().astype(int))
+            frames += [(int(z), f'key_{z:04d}.png', 'keyframes') for z in keys]
+        for z, name, mode in frames:
+            fn = os.path.join(case_dir, name)
+            if os.path.exists(fn) and not replace(mode):
+                continue
+            _save_png(slicer.get_image(dict(slicer.state, z_index=z)), fn)
+            written.append(fn)
+
+    return {'id': case['id'], 'files': len(written), 'seconds': time.perf_counter() - t0}
+
+
+# Parameters changing the pixels of every output, and those choosing a mode's files
+LOOK_PARAMS = ('hu', 'labels', 'mask_opacity', 'only_mask')
+MODE_PARAMS = {'animation': ('every',), 'slices': ('every',), 'keyframes': ('n_keyframes',)}
+
+
+def mode_params(mode, render_kwargs):
+    """JSON-comparable parameters of the files of `mode`, as recorded in the done marker."""
+    return json.loads(json.dumps({k: render_kwargs.get(k) for k in LOOK_PARAMS + MODE_PARAMS[mode]}))
+
+
+def _done_marker(out_dir, case_id):
+    return os.path.join(out_dir, '.done', f'{case_id}.json')
+
+
+def _done_outputs(out_dir, case_id):
+    """{mode: parameters} of the modes rendered for the case by earlier runs."""
+    try:
+        with open(_done_marker(out_dir, case_id)) as f:
+            return json.load(f).get('outputs', {})
+    except (OSError, ValueError):
+        return {}
+
+
+def run(cases, out_dir, workers, overwrite=False, log=sys.stderr, **render_kwargs):
+    os.makedirs(os.path.join(out_dir, '.done'), exist_ok=True)
+    wanted = {m: mode_params(m, render_kwargs) for m in render_kwargs['modes']}
+    todo = []
+    for c in cases:
+        done = {} if overwrite else _done_outputs(out_dir, c['id'])
+        pending = {m for m, params in wanted.items() if done.get(m) != params}
+        if not pending:
+            continue
+        # Files of a mode rendered with another window/labels/mask setting are replaced
+        stale = {m for m in pending if m in done and any(done[m].get(k) != wanted[m][k] for k in LOOK_PARAMS)}
+        todo.append((c, pending, True if overwrite else stale))
+    skipped = len(cases) - len(todo)
+    if skipped:
+        print(f"skipping {skipped} case(s) already done", file=log)
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(render_case, c, out_dir, **dict(render_kwargs, modes=pending, overwrite=replace)): c
+                   for c, pending, replace in todo}
+        for i, fut in enumerate(as_completed(futures), 1):
+            case = futures[fut]
+            try:
+                summary = fut.result()
+            except Exception as e:
+                failed += 1
+                print(f"[{i}/{len(todo)}] {case['id']}: FAILED ({type(e).__name__}: {e})", file=log)
+                continue
+            outputs = dict(_done_outputs(out_dir, case['id']), **wanted)
+            with open(_done_marker(out_dir, case['id']), 'w') as f:
+                json.dump(dict(summary, outputs=outputs, **case), f)
+            print(f"[{i}/{len(todo)}] {case['id']}: {summary['files']} file(s) in {summary['seconds']:.1f}s", file=log)
+    return failed
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog='liteviz-render', description=__doc__,
+                                formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('source', help='directory of cases or CSV manifest (id,image,mask)')
+    p.add_argument('-o', '--out', required=True, help='output directory')
+    p.add_argument('--mode', action='append', choices=['animation', 'slices', 'keyframes'],
+                   help='what to render (repeatable; default: animation)')
+    p.add_argument('--window', choices=sorted(WINDOWS), default='default', help='HU window preset')
+    p.add_argument('--hu', nargs=2, type=int, metavar=('MIN', 'MAX'),
+                   help='explicit HU range, e.g. --hu -130 600 (overrides --window)')
+    p.add_argument('--labels', choices=['default', 'saros-regions', 'saros-parts'], default='default')
+    p.add_argument('--mask-opacity', type=int, default=50)
+    p.add_argument('--only-mask', action='store_true')
+    p.add_argument('--every', type=int, default=1, help='render every N-th slice')
+    p.add_argument('--keyframes', type=int, default=5, help='number of evenly spaced key frames')
+    p.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes (default: all cores)')
+    p.add_argument('--threads', type=int, default=1, help='encoder threads per case')
+    p.add_argument('--overwrite', action='store_true', help='re-render cases already marked done')
+    args = p.parse_args(argv)
+
+    cases = find_cases(args.source)
+    if not cases:
+        p.error(f"no cases found in {args.source}")
+    failed = run(cases, args.out, args.workers, overwrite=args.overwrite,
+                 modes=set(args.mode or ['animation']), hu=tuple(args.hu or WINDOWS[args.window]),
+                 labels=args.labels, mask_opacity=args.mask_opacity, only_mask=args.only_mask,
+                 every=args.every, n_keyframes=args.keyframes, threads=args.threads)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,12 @@
 import ipywidgets as widgets
 
 class DicomControls:
-    """Reusable UI sliders and toggles for DicomSlicer parameters."""
-    def __init__(self, max_z, on_change=None):
+    """
+    Reusable UI sliders and toggles for DicomSlicer parameters. `axes` ({name: size}, e.g.
+    `NDSlicer.axis_sizes`) adds a `<name>_index` slider per extra axis; `cine_axis` also gets
+    a play button stepping its slider `fps` times per second.
+    """
+    def __init__(self, max_z, on_change=None, axes=None, cine_axis=None, fps=10):
         self.on_change = on_change
         self._programmatic_update = False
         
@@ -12,24 +16,58 @@ class DicomControls:
         self.mask_opacity = widgets.IntSlider(min=0, max=100, step=1, value=50, description='Opacity %')
         self.mask_on = widgets.ToggleButton(value=False, description='Mask On/Off')
         self.only_mask = widgets.ToggleButton(value=False, description='Img On/Off')
+        self.overlay_mode = widgets.ToggleButtons(options=[('Fill', 'fill'), ('Outline', 'outline')], value='fill',
+                                                  description='Overlay', style={'button_width': '70px'})
+        self.slab_mode = widgets.Dropdown(options=[('Off', 'none'), ('MIP', 'mip'), ('MinIP', 'minip'), ('Mean', 'mean')],
+                                          value='none', description='Slab')
+        self.slab_thickness = widgets.IntSlider(min=1, max=max(1, min(100, max_z + 1)), value=10, description='Slab slices')
+        
+        # One slider per extra axis of an N-D slicer, set as attribute `<name>_index`
+        self.axis_keys = []
+        self.cine_key = None
+        axis_widgets = []
+        for name, size in (axes or {}).items():
+            key = f'{name}_index'
+            slider = widgets.IntSlider(min=0, max=size - 1, value=0, description=name)
+            setattr(self, key, slider)
+            self.axis_keys.append(key)
+            if name == cine_axis:
+                self.cine_key = key
+                self.play = widgets.Play(min=0, max=size - 1, interval=int(1000 / fps), description='Cine')
+                widgets.jslink((self.play, 'value'), (slider, 'value'))
+                axis_widgets.append(widgets.HBox([self.play, slider]))
+            else:
+                axis_widgets.append(slider)
         
         self.widget = widgets.VBox([
-            self.z_index, self.hu, self.mask_opacity, self.mask_on, self.only_mask
+            self.z_index, *axis_widgets, self.hu, self.mask_opacity, self.mask_on, self.only_mask, self.overlay_mode,
+            self.slab_mode, self.slab_thickness
         ])
         
-        for w in [self.z_index, self.hu, self.mask_opacity, self.mask_on, self.only_mask]:
+        for w in [self.z_index, self.hu, self.mask_opacity, self.mask_on, self.only_mask, self.overlay_mode,
+                  self.slab_mode, self.slab_thickness] + [getattr(self, k) for k in self.axis_keys]:
             w.observe(self._on_change, names='value')
 
-    def _on_change(self, change):
-        if self._programmatic_update or not self.on_change:
-            return
-        self.on_change({
+    def get_state(self):
+        """Slicer state dict of the current control values."""
+        state = {
             'z_index': self.z_index.value,
             'hu': self.hu.value,
             'mask_opacity': self.mask_opacity.value,
             'mask_on': self.mask_on.value,
-            'only_mask': self.only_mask.value
-        })
+            'only_mask': self.only_mask.value,
+            'overlay_mode': self.overlay_mode.value,
+            'slab_mode': self.slab_mode.value,
+            'slab_thickness': self.slab_thickness.value
+        }
+        for k in self.axis_keys:
+            state[k] = getattr(self, k).value
+        return state
+
+    def _on_change(self, change):
+        if self._programmatic_update or not self.on_change:
+            return
+        self.on_change(self.get_state())
 
     def update_silently(self, **kwargs):
         self._programmatic_update = True
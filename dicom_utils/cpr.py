@@ -0,0 +1,288 @@
+"""
+Oblique and curved planar reformats.
+
+A CPRSlicer samples the volume on a 2D grid of points: an oblique plane (`set_plane`) or the
+surface swept by a line moving along a centreline (`set_centerline`, a "stretched" CPR). The
+`z_index` of the state moves that surface along its normal in `n_offsets` steps, so sliders,
+scrolling and `get_image` work as for a DicomSlicer. Coordinates are voxel indices (z, y, x);
+lengths (pixel size, width, offset step) are in the units of `spacing`.
+
+The sampling plan of a surface (integer corner indices and interpolation weights) is computed
+once per offset and kept in a small LRU, so window/level and mask changes only re-gather.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .dicom_utils import DicomSlicer, label_outline
+
+
+def _unit(v):
+    v = np.asarray(v, dtype=np.float64)
+    n = np.linalg.norm(v, axis=-1, keepdims=True)
+    if np.any(n == 0):
+        raise ValueError("direction vectors must be non-zero")
+    return v / n
+
+
+def _perpendicular(v, t):
+    """`v` made perpendicular to the unit vector(s) `t` and normalised; falls back to another axis when parallel."""
+    v = np.broadcast_to(np.asarray(v, dtype=np.float64), np.shape(t))
+    p = v - np.sum(v * t, axis=-1, keepdims=True) * t
+    small = np.linalg.norm(p, axis=-1) < 1e-6
+    if np.any(small):
+        other = np.where(np.abs(t[..., 2:3]) < 0.9, [0.0, 0.0, 1.0], [0.0, 1.0, 0.0])
+        q = other - np.sum(other * t, axis=-1, keepdims=True) * t
+        p = np.where(small[..., None], q, p)
+    return _unit(p)
+
+
+class SamplingPlan:
+    """
+    Where to read the pixels of one surface: the slab z0..z1 of the volume that contains them,
+    flat indices into that slab and trilinear weights, and which pixels lie inside the volume.
+    """
+    __slots__ = ('shape', 'z0', 'z1', 'base', 'steps', 'weights', 'nearest', 'inside')
+
+    def __init__(self, coords, volume_shape, linear=True):
+        depth, height, width = volume_shape
+        self.shape = coords.shape[1:]
+        c = coords.reshape(3, -1)
+        limits = np.array([depth, height, width])[:, None]
+        if linear:
+            self.inside = np.all((c >= 0) & (c <= limits - 1), axis=0)
+        else:
+            self.inside = np.all((c >= -0.5) & (c < limits - 0.5), axis=0)
+        c = np.clip(c, 0, limits - 1)
+        near = np.floor(c + 0.5).astype(np.intp)
+        np.minimum(near, limits - 1, out=near)
+        lo = np.floor(c).astype(np.intp) if linear else near
+        hi = np.minimum(lo + 1, limits - 1)
+        if self.inside.any():
+            self.z0 = int(lo[0][self.inside].min())
+            self.z1 = int(hi[0][self.inside].max()) + 1
+        else:
+            self.z0, self.z1 = 0, 1
+        lo[0] -= self.z0
+        hi[0] -= self.z0
+        near[0] -= self.z0
+        np.clip(lo[0], 0, self.z1 - self.z0 - 1, out=lo[0])
+        np.clip(hi[0], 0, self.z1 - self.z0 - 1, out=hi[0])
+        np.clip(near[0], 0, self.z1 - self.z0 - 1, out=near[0])
+        strides = np.array([height * width, width, 1])[:, None]
+        self.nearest = np.sum(near * strides, axis=0)
+        if linear:
+            self.base = np.sum(lo * strides, axis=0)
+            self.steps = (hi - lo) * strides  # 0 where the upper neighbour was clipped
+            self.weights = (c - lo - np.array([self.z0, 0, 0])[:, None]).astype(np.float32)
+        else:
+            self.base = self.steps = self.weights = None
+
+    @property
+    def nbytes(self):
+        arrays = (self.base, self.steps, self.weights, self.nearest, self.inside)
+        return sum(a.nbytes for a in arrays if a is not None)
+
+    def sample(self, volume):
+        """Values of `volume` (any array or VolumeSource) at the plan's points, as a 2D array."""
+        flat = np.asarray(volume[self.z0:self.z1]).reshape(-1)
+        if self.base is None:
+            return flat[self.nearest].reshape(self.shape)
+        b = self.base
+        sz, sy, sx = self.steps
+        fz, fy, fx = self.weights
+        v = lambda idx: flat[idx].astype(np.float32)
+        c00 = v(b) + (v(b + sx) - v(b)) * fx
+        c01 = v(b + sy) + (v(b + sy + sx) - v(b + sy)) * fx
+        c10 = v(b + sz) + (v(b + sz + sx) - v(b + sz)) * fx
+        c11 = v(b + sz + sy) + (v(b + sz + sy + sx) - v(b + sz + sy)) * fx
+        c0 = c00 + (c01 - c00) * fy
+        c1 = c10 + (c11 - c10) * fy
+        return (c0 + (c1 - c0) * fz).reshape(self.shape)
+
+    def sample_nearest(self, volume):
+        flat = np.asarray(volume[self.z0:self.z1]).reshape(-1)
+        return flat[self.nearest].reshape(self.shape)
+
+
+class CPRSlicer(DicomSlicer):
+    """
+    DicomSlicer over an oblique plane or a curved reformat of the volume:
+
+        slicer = CPRSlicer(ct, mask, spacing=(2.5, 0.7, 0.7))
+        slicer.set_plane(center=(60, 256, 256), normal=(1, 0.3, 0), size=(384, 384))
+        slicer.set_centerline(points, width=60, pixel_size=0.5)   # (N, 3) voxel coordinates
+        slicer.update_state(z_index=slicer.state['z_index'] + 1)   # next parallel surface
+        frame = slicer.get_image()
+
+    The image is sampled with `interpolation='linear'` (trilinear) or 'nearest'; labels are
+    always nearest, so overlays look as in the other slicers. Without a geometry the slicer
+    shows axial planes through the volume. The `lod` and `viewport` state entries are not used.
+    """
+    # Oblique and curved planes read many mask slices
+    slice_local_mask = False
+
+    def __init__(self, image_array, mask=None, origin=None, spacing=None, label_to_organ=None, organ_to_color=None,
+                 interpolation='linear', plan_cache_size=8):
+        super().__init__(image_array, mask=mask, origin=origin, spacing=spacing,
+                         label_to_organ=label_to_organ, organ_to_color=organ_to_color)
+        self.interpolation = interpolation
+        self.plan_cache_size = plan_cache_size
+        self._plans = OrderedDict()  # (geometry_version, z_index, linear) -> SamplingPlan
+        self._plans_lock = threading.Lock()
+        self._samples = None  # (plan key, data_version, values) of the last sampled image
+        self.geometry_version = 0
+        depth, height, width = self.img.shape[:3]
+        spacing = np.asarray(self.spacing, dtype=np.float64)
+        self.set_plane(center=(depth // 2, (height - 1) / 2, (width - 1) / 2), normal=(1, 0, 0),
+                       size=(height, width), pixel_size=float(min(spacing[1:])),
+                       n_offsets=depth, offset_step=float(spacing[0]))
+
+    @property
+    def _spacing(self):
+        return np.asarray(self.spacing, dtype=np.float64)
+
+    def _set_geometry(self, base, direction, n_offsets):
+        """Install a surface: voxel coordinates `base` (3, H, W) and the voxel step `direction` per offset."""
+        self.base_coords = base.astype(np.float32)
+        self.offset_direction = direction.astype(np.float32)
+        self.n_offsets = int(n_offsets)
+        self.geometry_version += 1
+        with self._plans_lock:
+            self._plans.clear()
+        self._samples = None
+        self.state.update(z_index=self.n_offsets // 2, z_index_min=0, z_index_max=self.n_offsets - 1)
+        if self.frame_cache is not None:
+            self.frame_cache.clear()
+
+    def set_plane(self, center, normal, size=(512, 512), pixel_size=1.0, row_direction=None,
+                  n_offsets=1, offset_step=1.0):
+        """
+        Oblique plane through voxel `center` (z, y, x) perpendicular to `normal` (physical (z, y, x)
+        direction), `size` (rows, cols) pixels of `pixel_size`. Rows run along `row_direction`
+        projected onto the plane (default: close to +y, so an axial normal gives the usual axial
+        view). `z_index` moves the plane along the normal by `offset_step`.
+        """
+        spacing = self._spacing
+        normal = _unit(normal)
+        hint = row_direction if row_direction is not None else (0.0, 1.0, 0.0)
+        rows = _perpendicular(hint, normal)
+        cols = np.cross(normal, rows)
+        h, w = size
+        i = (np.arange(h) - (h - 1) / 2) * pixel_size
+        j = (np.arange(w) - (w - 1) / 2) * pixel_size
+        points = (i[None, :, None] * (rows / spacing)[:, None, None]
+                  + j[None, None, :] * (cols / spacing)[:, None, None])
+        base = np.asarray(center, dtype=np.float64)[:, None, None] + points
+        direction = (normal * offset_step / spacing)[:, None, None]
+        self._set_geometry(base - direction * (int(n_offsets) // 2), direction, n_offsets)
+
+    def set_centerline(self, points, width=50.0, pixel_size=1.0, lateral=(0.0, 0.0, 1.0),
+                       n_offsets=1, offset_step=1.0):
+        """
+        Stretched curved reformat along the polyline `points` ((N, 3) voxel coordinates): each row
+        is a point of the centreline (every `pixel_size` along it), each column a point on the line
+        of length `width` through it, perpendicular to the centreline and as close as possible to
+        the physical direction `lateral`. `z_index` moves the surface across the centreline.
+        """
+        spacing = self._spacing
+        points = np.asarray(points, dtype=np.float64) * spacing
+        if points.ndim != 2 or points.shape[1] != 3 or len(points) < 2:
+            raise ValueError("centerline needs at least two (z, y, x) points")
+        seg = np.linalg.norm(np.diff(points, axis=0), axis=1)
+        arc = np.concatenate([[0.0], np.cumsum(seg)])
+        s = np.arange(0.0, arc[-1] + 1e-9, pixel_size)
+        line = np.stack([np.interp(s, arc, points[:, k]) for k in range(3)], axis=1)
+        tangent = _unit(np.gradient(line, axis=0)) if len(line) > 1 else _unit(points[-1] - points[0])[None]
+        across = _perpendicular(lateral, tangent)
+        normal = np.cross(tangent, across)
+        n_cols = max(1, int(round(width / pixel_size)))
+        j = (np.arange(n_cols) - (n_cols - 1) / 2) * pixel_size
+        mm = line.T[:, :, None] + across.T[:, :, None] * j[None, None, :]
+        direction = (normal.T * offset_step)[:, :, None]
+        base = (mm - direction * (int(n_offsets) // 2)) / spacing[:, None, None]
+        self._set_geometry(base, direction / spacing[:, None, None], n_offsets)
+
+    def set_data(self, image, mask=None):
+        super().set_data(image, mask)
+        with self._plans_lock:
+            self._plans.clear()
+        self._samples = None
+        self.state['z_index_max'] = self.n_offsets - 1
+
+    # --- Sampling ---
+    def coords(self, z_index=None):
+        """Voxel coordinates (3, H, W) of the surface at offset `z_index` (default: the state's)."""
+        z_index = self.state['z_index'] if z_index is None else z_index
+        return self.base_coords + self.offset_direction * np.float32(z_index)
+
+    def plan(self, z_index, linear=None):
+        """Cached SamplingPlan of offset `z_index`."""
+        linear = self.interpolation == 'linear' if linear is None else linear
+        key = (self.geometry_version, int(z_index), linear)
+        with self._plans_lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+                return plan
+        plan = SamplingPlan(self.coords(z_index), self.img.shape[:3], linear)
+        with self._plans_lock:
+            self._plans[key] = plan
+            while len(self._plans) > self.plan_cache_size:
+                self._plans.popitem(last=False)
+        return plan
+
+    def sample_image(self, z_index):
+        """Resampled image values of offset `z_index` (float32 with linear interpolation)."""
+        linear = self.interpolation == 'linear'
+        key = (self.geometry_version, int(z_index), linear, self.data_version)
+        cached = self._samples
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        plan = self.plan(z_index, linear)
+        values = plan.sample(self.img) if linear else plan.sample_nearest(self.img)
+        self._samples = (key, values)
+        return values
+
+    def voxel_at(self, x, y, state=None):
+        """Nearest voxel (z, y, x) under frame pixel (x, y), or None outside the surface."""
+        st = self.state if state is None else state
+        h, w = self.base_coords.shape[1:]
+        if not (0 <= y < h and 0 <= x < w):
+            return None
+        direction = np.broadcast_to(self.offset_direction, self.base_coords.shape)
+        c = self.base_coords[:, int(y), int(x)] + direction[:, int(y), int(x)] * st['z_index']
+        return tuple(int(v) for v in np.floor(c + 0.5))
+
+    def get_value_at_jk(self, j, k):
+        voxel = self.voxel_at(k, j)
+        if voxel is None or not all(0 <= v < n for v, n in zip(voxel, self.img.shape[:3])):
+            return None
+        return self.img[voxel]
+
+    def frame_key(self, state=None):
+        return super().frame_key(state) + (self.geometry_version, self.interpolation)
+
+    def get_image(self, state=None, live=False):
+        # Every frame is resampled, so there is no kept frame to repaint (`live` is not used)
+        state = self.state if state is None else state
+        z_index = state['z_index']
+        height, width = self.base_coords.shape[1:]
+        timer = self.timer
+        gray = labels = None
+        with timer.stage('plan'):
+            plan = self.plan(z_index)
+        if not state['only_mask']:
+            with timer.stage('extract'):
+                values = self.sample_image(z_index)
+            with timer.stage('window'):
+                gray = self.window_lut(values, hu=state['hu'])
+                gray[~plan.inside.reshape(plan.shape)] = 0
+        if self.mask is not None and state['mask_on']:
+            with timer.stage('extract_mask'):
+                labels = plan.sample_nearest(self.mask)
+                labels = np.where(plan.inside.reshape(plan.shape), labels, 0).astype(labels.dtype)
+            if state.get('overlay_mode', 'fill') == 'outline':
+                labels = label_outline(labels)
+        return self.compose(gray, labels, state, (height, width))
@@ -1,7 +1,22 @@
 import io
+import math
+import threading
+from collections import OrderedDict
 import numpy as np
 from PIL import Image as PILImage
 from contextlib import contextmanager
+from dataclasses import dataclass
+
+from .frame_cache import show_frame
+from .profiling import StageTimer, NULL_TIMER
+from .prefetch import SlicePrefetcher
+from .scheduler import RenderScheduler
+from .sources import as_volume
+from .export import export_animation
+from .history import EditHistory
+from .label_index import LabelIndex
+from .slab import SlabProjector
+from .viewport import sample_indices, display_to_source
 
 import ipywidgets as widgets
 from ipywidgets import Image, Output, IntSlider, IntRangeSlider, ToggleButton, VBox, HBox
@@ -45,6 +60,143 @@ def HU_to_gray(image, hu=(-140, 900)):
     re_imgs = np.clip(255 * (img_f - low) / (high - low), 0, 255).astype(np.uint8)
     return re_imgs
 
+class WindowLUT:
+    """
+    HU windowing via a uint8 lookup table indexed by the raw value (8/16-bit integer images).
+    The table for the last `hu` is cached. On a miss it is only built when the image has
+    enough pixels to pay for it (`min_pixels_per_entry`); otherwise, and for float or
+    32/64-bit data, the float path of HU_to_gray is used.
+    """
+    min_pixels_per_entry = 4
+
+    def __init__(self):
+        self._cached = None  # (dtype, hu, lut), replaced as a whole so threads see a consistent entry
+
+    @staticmethod
+    def supports(dtype):
+        return np.dtype(dtype).kind in 'iu' and np.dtype(dtype).itemsize <= 2
+
+    def get_lut(self, dtype, hu):
+        dtype = np.dtype(dtype)
+        cached = self._cached
+        if cached is not None and cached[0] == dtype and cached[1] == hu:
+            return cached[2]
+        # Enumerate every value in the order of its unsigned bit pattern, so that
+        # signed images can index the table through a zero-copy unsigned view.
+        unsigned = np.dtype(f'u{dtype.itemsize}')
+        values = np.arange(2 ** (8 * dtype.itemsize), dtype=unsigned).view(dtype)
+        lut = HU_to_gray(values, hu=hu)
+        self._cached = (dtype, hu, lut)
+        return lut
+
+    def __call__(self, image, hu=(-140, 900)):
+        if not self.supports(image.dtype):
+            return HU_to_gray(image, hu=hu)
+        hu = tuple(hu)
+        cached = self._cached
+        is_hit = cached is not None and cached[0] == image.dtype and cached[1] == hu
+        n_entries = 2 ** (8 * image.dtype.itemsize)
+        if not is_hit and image.size < self.min_pixels_per_entry * n_entries:
+            return HU_to_gray(image, hu=hu)
+        lut = self.get_lut(image.dtype, hu)
+        return np.take(lut, image.view(f'u{image.dtype.itemsize}'))
+
+def build_label_palette(label_to_organ, organ_to_color):
+    """
+    Compile label/organ/color mappings into an RGBA lookup table indexed by label value.
+    The last row is left transparent and is used for labels outside the table.
+    """
+    labels = [int(label) for label, organ in label_to_organ.items()
+              if int(label) > 0 and organ in organ_to_color]
+    palette = np.zeros((max(labels, default=0) + 2, 4), dtype=np.uint8)
+    for label, organ in label_to_organ.items():
+        if int(label) > 0 and organ in organ_to_color:
+            palette[int(label)] = organ_to_color[organ]
+    return palette
+
+def labels_to_rgba(mask_slice, palette):
+    """Map a label slice to RGBA with a single gather; unknown labels become transparent."""
+    if mask_slice.dtype.kind not in 'iub':
+        mask_slice = mask_slice.astype(np.intp)
+    return np.take(palette, mask_slice, axis=0, mode='clip')
+
+class BlendLUT:
+    """
+    Fused gray + label overlay blending. For a palette (alpha already scaled by the opacity)
+    it keeps a (labels x 256) table of the RGB result of alpha-compositing each label colour
+    over each gray level, computed once with PIL's own `alpha_composite`, so frames are
+    identical to compositing them with PIL. Entries are packed RGBX uint32, so a frame costs
+    one uint16 index pass and one gather into a per-thread output buffer instead of RGBA
+    conversions, an overlay array and a composite.
+    """
+    def __init__(self):
+        self._cached = None  # (palette bytes, table), replaced as a whole so threads see a consistent entry
+        self._local = threading.local()
+
+    def get_table(self, palette):
+        key = palette.tobytes()
+        cached = self._cached
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        # At least 256 rows, so uint8 labels never need clipping; extra rows repeat the
+        # transparent last palette row (labels outside the table, as in labels_to_rgba)
+        rows = max(len(palette), 256)
+        palette = np.concatenate([palette, np.repeat(palette[-1:], rows - len(palette), axis=0)])
+        base = PILImage.fromarray(np.tile(np.arange(256, dtype=np.uint8), (rows, 1))).convert('RGBA')
+        overlay = PILImage.fromarray(np.ascontiguousarray(np.repeat(palette[:, None, :], 256, axis=1)), 'RGBA')
+        table = np.asarray(PILImage.alpha_composite(base, overlay)).copy()
+        table[..., 3] = 255
+        table = table.view(np.uint32).reshape(rows * 256)
+        self._cached = (key, table)
+        return table
+
+    def buffer(self, shape):
+        """Reusable uint32 (RGBX) output array of the calling thread."""
+        buf = getattr(self._local, 'buf', None)
+        if buf is None or buf.shape != shape:
+            buf = np.empty(shape, dtype=np.uint32)
+            self._local.buf = buf
+        return buf
+
+    def __call__(self, gray, labels, palette, out):
+        """Write the RGBX blend of `gray` and `labels` (same 2D shape) into `out`."""
+        table = self.get_table(palette)
+        rows = len(table) // 256
+        if labels is None:
+            # Label 0 is transparent: the first row maps gray levels to themselves
+            return np.take(table[:256], gray, out=out, mode='wrap')
+        if labels.dtype == np.uint8:
+            idx = np.left_shift(labels, 8, dtype=np.uint16)
+        else:
+            idx = labels.astype(np.uint16 if rows <= 256 else np.uint32)
+            if labels.dtype.kind != 'u' or np.iinfo(labels.dtype).max >= rows:
+                np.minimum(idx, rows - 1, out=idx)
+            idx <<= 8
+        idx |= gray
+        return np.take(table, idx, out=out, mode='wrap')
+
+
+def label_outline(labels):
+    """
+    Keep only the border pixels of each labelled region (pixels with a 4-neighbour of another
+    label, background included); everything else becomes 0. Works on the last two axes.
+    """
+    edge = np.zeros(labels.shape, dtype=bool)
+    rows = labels[..., 1:, :] != labels[..., :-1, :]
+    edge[..., 1:, :] |= rows
+    edge[..., :-1, :] |= rows
+    cols = labels[..., :, 1:] != labels[..., :, :-1]
+    edge[..., :, 1:] |= cols
+    edge[..., :, :-1] |= cols
+    return np.where(edge, labels, 0).astype(labels.dtype, copy=False)
+
+def labels_outside(labels, box):
+    """True if the 2D `labels` have a non-zero label outside `box` (y0, y1, x0, x1; empty: anywhere)."""
+    y0, y1, x0, x1 = box
+    if y0 >= y1 or x0 >= x1:
+        return bool(labels.any())
+    return bool(labels[:y0].any() or labels[y1:].any() or labels[y0:y1, :x0].any() or labels[y0:y1, x1:].any())
+
 def save_PILlst_webp(frames, fn='animation.webp', format='webp'):
     """Save a list of PIL images as a WebP animation."""
     if not frames:
@@ -59,16 +211,52 @@ def save_PILlst_webp(frames, fn='animation.webp', format='webp'):
         quality=95
     )
 
+def _tile(stack, rows, cols):
+    """Arrange an (n, h, w, ...) stack into a (rows*h, cols*w, ...) grid, padding missing tiles with zeros."""
+    n, h, w = stack.shape[:3]
+    rest = stack.shape[3:]
+    if n < rows * cols:
+        stack = np.concatenate([stack, np.zeros((rows * cols - n, h, w) + rest, dtype=stack.dtype)])
+    grid = stack.reshape((rows, cols, h, w) + rest).swapaxes(1, 2)
+    return grid.reshape((rows * h, cols * w) + rest)
+
+@dataclass
+class MosaicLayout:
+    """Where each slice of a mosaic sits: tile (r, c) shows slice z_indices[r * cols + c]."""
+    z_indices: tuple
+    rows: int
+    cols: int
+    tile_height: int
+    tile_width: int
+    downsample: int = 1
+
+    @property
+    def size(self):
+        """(width, height) of the mosaic image in pixels."""
+        return self.cols * self.tile_width, self.rows * self.tile_height
+
+    def z_at(self, x, y):
+        """Slice index under mosaic pixel (x, y), or None for padding tiles and out-of-range points."""
+        r, c = int(y) // self.tile_height, int(x) // self.tile_width
+        if not (0 <= r < self.rows and 0 <= c < self.cols):
+            return None
+        i = r * self.cols + c
+        return self.z_indices[i] if i < len(self.z_indices) else None
+
 # --- 1. DicomSlicer (The Logic / Model) ---
 class DicomSlicer:
     """
     Handles DICOM data, state management, and image generation.
     Independent of ipywidgets.
     """
+    # The frame of slice z shows only mask slice z, so an edit invalidates just that slice's frames
+    slice_local_mask = True
+
     def __init__(self, image_array, mask=None, origin=None, spacing=None, label_to_organ=None, organ_to_color=None):
 
-        self.img = image_array
-        self.mask = mask
+        # Arrays, np.memmap, VolumeSource objects or paths (opened lazily, see sources.open_volume)
+        self.img = as_volume(image_array)
+        self.mask = as_volume(mask)
 
         self.origin = origin if origin is not None else (0, 0, 0)
         self.spacing = spacing if spacing is not None else (1, 1, 1)
@@ -81,115 +269,500 @@ class DicomSlicer:
             'hu': (-130, 600),
             'mask_opacity': 50,  # 0-100
             'mask_on': False,
-            'only_mask': False
+            'only_mask': False,
+            'lod': 1,  # level of detail: render every lod-th pixel (previews during interaction)
+            'overlay_mode': 'fill',  # 'fill' or 'outline' (label borders only)
+            'viewport': None,  # (y0, y1, x0, x1, height, width): source region resampled to a display size, see viewport.py
+            'slab_mode': 'none',  # 'none', 'mip', 'minip' or 'mean' over `slab_thickness` slices centred on z_index
+            'slab_thickness': 1
         }
 
         self.label_to_organ = label_to_organ if label_to_organ else default_label_to_organ
         self.organ_to_color = organ_to_color if organ_to_color else default_organ_to_color 
+        self.palette = build_label_palette(self.label_to_organ, self.organ_to_color)
+        self.window_lut = WindowLUT()
+        self.blend_lut = BlendLUT()
+
+        # Bumped whenever image/mask content changes; part of every frame_key
+        self.data_version = 0
+        self.mask_version = 0
+        self._slice_mask_versions = {}  # z -> mask_version of its last edit, see `slice_mask_version`
+        self._mask_epoch = 0  # mask_version of the last edit that may have touched every slice
+        self.frame_cache = None  # optional FrameCache of encoded frames
+        self.timer = NULL_TIMER  # set a StageTimer to record per-stage render timings
+        # Last full-resolution frame of the displayed slice, repainted in place after edit_mask:
+        # (frame_key without mask_version, image, dirty bbox (y0, y1, x0, x1) or None)
+        self._live_frame = None
+        self._live_lock = threading.Lock()
+        self.history = EditHistory()  # undo/redo of edit_mask / record_mask_edit changes (None: off)
+        self._label_index = None  # LabelIndex, built on first use of `label_index`
+        self._outlines = OrderedDict()  # (z, lod, data_version, slice mask version) -> outline labels, see `outline_slice`
+        self._outlines_lock = threading.Lock()
+        self.outline_cache_size = 32
+        self._slab = None  # (mode, thickness, data_version, SlabProjector), see `image_slice`
 
     def update_state(self, **kwargs):
         """Update internal state dictionary."""
         self.state.update(kwargs)
 
     def set_data(self, image, mask=None):
-        """Update the underlying data."""
-        self.img = image
-        self.mask = mask
+        """Update the underlying data (arrays, sources or paths)."""
+        self.img = as_volume(image)
+        self.mask = as_volume(mask)
         self.state['z_index_max'] = self.img.shape[0]-1
         # Ensure z_index is within new bounds
         if self.state['z_index'] >= self.state['z_index_max']:
             self.state['z_index'] = 0
+        self.palette = build_label_palette(self.label_to_organ, self.organ_to_color)
+        self.data_version += 1
+        self._label_index = None
+        with self._outlines_lock:
+            self._outlines.clear()
+        if self.history is not None:
+            self.history.clear()
+        if self.frame_cache is not None:
+            self.frame_cache.clear()
 
     def set_mask_mappings(self, label_to_organ, organ_to_color):
         self.label_to_organ = label_to_organ
         self.organ_to_color = organ_to_color
+        self.palette = build_label_palette(self.label_to_organ, self.organ_to_color)
+        self.mark_mask_edited()
+
+    def mark_mask_edited(self, z_index=None, bbox=None):
+        """
+        Call after modifying `self.mask` in place (`z_index=None` means any slice may have changed).
+        `bbox=(y0, y1, x0, x1)` bounds the change, so the displayed frame is repainted only there.
+        """
+        with self._live_lock:
+            self.mask_version += 1
+            if z_index is None:
+                self._mask_epoch = self.mask_version
+                self._slice_mask_versions.clear()
+            else:
+                self._slice_mask_versions[z_index] = self.mask_version
+            live = self._live_frame
+            if live is not None and (z_index is None or z_index == live[0][0]):
+                if bbox is None:
+                    self._live_frame = None
+                else:
+                    dirty = live[2]
+                    if dirty is not None:
+                        bbox = (min(bbox[0], dirty[0]), max(bbox[1], dirty[1]),
+                                min(bbox[2], dirty[2]), max(bbox[3], dirty[3]))
+                    self._live_frame = (live[0], live[1], bbox)
+        if self._label_index is not None:
+            if z_index is None:
+                self._label_index = None  # rebuilt in one pass when next needed
+            else:
+                self._label_index.invalidate(z_index)
+        if self.frame_cache is not None:
+            if z_index is None or not self.slice_local_mask:
+                self.frame_cache.clear()
+            else:
+                self.frame_cache.discard_slice(z_index)
+
+    @property
+    def label_index(self):
+        """LabelIndex of the mask (built in one pass on first access; None without a mask)."""
+        if self._label_index is None and self.mask is not None:
+            self._label_index = LabelIndex(self.mask)
+        return self._label_index
+
+    def label_value(self, label):
+        """Label number for an int, an IntEnum member (e.g. BodyRegions.THYROID_GLANDS) or an organ name."""
+        if isinstance(label, str):
+            for value, organ in self.label_to_organ.items():
+                if organ == label:
+                    return int(value)
+            raise KeyError(f"unknown label {label!r}")
+        return int(label)
+
+    def next_slice_with(self, label=None, direction=1, z_index=None):
+        """
+        Nearest slice after (`direction=1`) or before (`direction=-1`) `z_index` (default: the
+        current slice) containing `label` (None: any label), or None if there is none.
+        """
+        if self.mask is None:
+            return None
+        z_index = self.state['z_index'] if z_index is None else z_index
+        label = None if label is None else self.label_value(label)
+        return self.label_index.next_slice(label, z_index, direction)
+
+    def edit_mask(self, z_index, ys, xs, label):
+        """
+        Set `mask[z_index, ys, xs] = label` (ys/xs: indices or index arrays), record it in the
+        edit history and mark the touched bounding box dirty. Returns the bbox (y0, y1, x0, x1).
+        """
+        ys, xs = np.atleast_1d(ys), np.atleast_1d(xs)
+        if ys.size == 0:
+            return None
+        if self.history is not None:
+            old = np.array(self.mask[z_index, ys, xs])
+        self.mask[z_index, ys, xs] = label
+        if self.history is not None:
+            self.history.record(z_index, ys, xs, old, label, self.mask.shape[2])
+        bbox = (int(ys.min()), int(ys.max()) + 1, int(xs.min()), int(xs.max()) + 1)
+        self.mark_mask_edited(z_index, bbox=bbox)
+        return bbox
+
+    def record_mask_edit(self, z_index, before):
+        """
+        Record an in-place change of mask slice `z_index`, given a copy of the slice from `before`
+        the change: the differing pixels go into the edit history and only their bbox is repainted.
+        """
+        ys, xs = np.nonzero(np.asarray(self.mask[z_index]) != before)
+        if ys.size == 0:
+            return None
+        if self.history is not None:
+            self.history.record(z_index, ys, xs, before[ys, xs], np.asarray(self.mask[z_index])[ys, xs],
+                                self.mask.shape[2])
+        bbox = (int(ys.min()), int(ys.max()) + 1, int(xs.min()), int(xs.max()) + 1)
+        self.mark_mask_edited(z_index, bbox=bbox)
+        return bbox
+
+    def undo(self):
+        """Undo the last recorded mask operation; returns False if there was nothing to undo."""
+        return self._replay(self.history.undo)
+
+    def redo(self):
+        return self._replay(self.history.redo)
+
+    def _replay(self, step):
+        if self.history is None or self.mask is None:
+            return False
+        touched = step(self.mask)
+        if touched is None:
+            return False
+        for z, bbox in touched:
+            self.mark_mask_edited(z, bbox=bbox)
+        return True
+
+    def slice_mask_version(self, z_index):
+        """
+        Version of mask slice `z_index`: it changes only with edits that may have touched that
+        slice, so frames of the other slices stay valid (all edits count without `slice_local_mask`).
+        """
+        if not self.slice_local_mask:
+            return self.mask_version
+        return self._slice_mask_versions.get(z_index, self._mask_epoch)
+
+    def frame_key(self, state=None):
+        """Hashable description of everything the frame for `state` (default: current state) depends on."""
+        st = self.state if state is None else state
+        return (st['z_index'], tuple(st['hu']), st['mask_opacity'], st['mask_on'], st['only_mask'], st['lod'],
+                st.get('overlay_mode', 'fill'), st.get('viewport'), st.get('slab_mode', 'none'),
+                st.get('slab_thickness', 1), self.data_version, self.slice_mask_version(st['z_index']))
+
+    def preview_lod(self, max_size=512):
+        """Smallest integer downsampling factor that brings a frame within `max_size` pixels per side."""
+        viewport = self.state.get('viewport')
+        size = max(viewport[4:6]) if viewport is not None else max(self.img.shape[1:3])
+        return max(1, -(-size // max_size))
     
+    def outline_slice(self, z_index, lod=1):
+        """Label borders of mask slice `z_index` (see `label_outline`), cached per (slice, lod, data and mask version)."""
+        key = (z_index, lod, self.data_version, self.slice_mask_version(z_index))
+        with self._outlines_lock:
+            outline = self._outlines.get(key)
+            if outline is not None:
+                self._outlines.move_to_end(key)
+                return outline
+        outline = label_outline(np.asarray(self.mask[z_index][::lod, ::lod]))
+        with self._outlines_lock:
+            self._outlines[key] = outline
+            while len(self._outlines) > self.outline_cache_size:
+                self._outlines.popitem(last=False)
+        return outline
+
+    def image_slice(self, z_index, state=None):
+        """Image slice `z_index`, or its slab projection when the state's `slab_mode` is set."""
+        st = self.state if state is None else state
+        mode, thickness = st.get('slab_mode', 'none'), st.get('slab_thickness', 1)
+        if mode == 'none' or thickness <= 1:
+            return self.img[z_index]
+        slab = self._slab
+        if slab is None or slab[:3] != (mode, thickness, self.data_version):
+            # One projector per setting; it keeps the running sum / block extrema between frames
+            slab = (mode, thickness, self.data_version, SlabProjector(self.img, mode, thickness))
+            self._slab = slab
+        return slab[3].project(z_index)
+
+    def display_to_source(self, x, y, state=None):
+        """Source pixel (x, y) under pixel (x, y) of a frame rendered for `state` (viewport and lod)."""
+        st = self.state if state is None else state
+        return display_to_source(st.get('viewport'), x, y, st.get('lod', 1))
+
     def get_value_at_jk(self, j,k):
         i = self.state['z_index']
         HU = self.img[i,j,k]
         return HU
 
-    def get_image(self):
-        """Generate and return the PIL Image based on current state."""
-        # Unpack state
-        z_index = self.state['z_index']
-        hu = self.state['hu']
-        mask_opacity = self.state['mask_opacity']
-        mask_on = self.state['mask_on']
-        only_mask = self.state['only_mask']
+    def get_image(self, state=None, live=False):
+        """
+        Generate and return the PIL Image based on current state.
+        Pass a snapshot `state` dict to render without touching `self.state` (e.g. from worker threads).
+        `live=True` is for the displayed frame only (see `show_frame`), never for worker threads:
+        the frame is kept, so the next render after `edit_mask` repaints only the edited bbox.
+        Once the label index exists (built on first use of `label_index`, e.g. by `next_slice_with`),
+        the overlay is skipped on slices without labels and cropped to their bounding box otherwise.
+        """
+        state = self.state if state is None else state
+        z_index = state['z_index']
+        lod = state.get('lod', 1)
+
+        viewport = state.get('viewport')
+        live = live and lod == 1 and viewport is None
+        if live:
+            key = self.frame_key(state)[:-1]
+            with self._live_lock:
+                frame = self._live_frame
+                # Reused only to repaint recorded edits: `self.mask` may also be written to directly
+                if frame is not None and frame[0] == key and frame[2] is not None:
+                    frame = (key, self._repaint(frame[1], frame[2], state), None)
+                    self._live_frame = frame
+                    return frame[1]
+                mask_version = self.mask_version
+
+        if viewport is not None:
+            # Only the visible region is read, resampled to the display size before any other work
+            ys, xs, y_inside, x_inside = sample_indices(viewport, self.img.shape[1:3], lod)
+            px = np.ix_(ys, xs)
+            height, width = len(ys), len(xs)
+        else:
+            # Strided view: with lod > 1 only every lod-th row/column is read
+            px = np.s_[::lod, ::lod] if lod > 1 else np.s_[:, :]
+            height = -(-self.img.shape[1] // lod)
+            width = -(-self.img.shape[2] // lod)
+
+        gray = labels = None
+        timer = self.timer
+        if not state['only_mask']:
+            with timer.stage('extract'):
+                img_slice = self.image_slice(z_index, state)[px]
+            with timer.stage('window'):
+                gray = self.window_lut(img_slice, hu=state['hu'])
+        overlay_box = None
+        if self.mask is not None and state['mask_on']:
+            if state.get('overlay_mode', 'fill') == 'outline':
+                with timer.stage('outline'):
+                    labels = self.outline_slice(z_index, lod) if viewport is None else self.outline_slice(z_index)[px]
+            else:
+                with timer.stage('extract_mask'):
+                    labels = self.mask[z_index][px]
+            index = self._label_index
+            if viewport is None and index is not None and not index.is_stale(z_index):
+                # Skip the overlay on slices without labels, crop it to the labelled region otherwise
+                box = index.bbox(z_index)
+                if box is None:
+                    overlay_box = (0, 0, 0, 0)
+                else:
+                    y0, y1, x0, x1 = box
+                    overlay_box = (y0 // lod, -(-y1 // lod), x0 // lod, -(-x1 // lod))
+                if labels_outside(labels, overlay_box):
+                    # `self.mask` was written to without `mark_mask_edited`: the index is out of date
+                    overlay_box = None
+        if viewport is not None and not (y_inside.all() and x_inside.all()):
+            # Parts of the view outside the slice are black / unlabelled
+            outside = ~(y_inside[:, None] & x_inside[None, :])
+            if gray is not None:
+                gray = np.where(outside, 0, gray).astype(np.uint8)
+            if labels is not None:
+                labels = np.where(outside, 0, labels).astype(labels.dtype)
+        im_pil = self.compose(gray, labels, state, (height, width), overlay_box)
+
+        if live:
+            with self._live_lock:
+                # Only keep it if no edit happened while rendering
+                if self.mask_version == mask_version:
+                    self._live_frame = (key, im_pil, None)
+        return im_pil
+
+    def _repaint(self, im_pil, bbox, state):
+        """Copy of `im_pil` with the region `bbox` of the slice in `state` re-rendered."""
+        y0, y1, x0, x1 = bbox
+        z_index = state['z_index']
+        outline = self.mask is not None and state['mask_on'] and state.get('overlay_mode', 'fill') == 'outline'
+        if outline:
+            # An edit also changes the borders of the pixels right next to it
+            h, w = self.mask.shape[1:3]
+            y0, y1, x0, x1 = max(y0 - 1, 0), min(y1 + 1, h), max(x0 - 1, 0), min(x1 + 1, w)
+        gray = labels = None
+        with self.timer.stage('repaint'):
+            if not state['only_mask']:
+                gray = self.window_lut(np.asarray(self.image_slice(z_index, state)[y0:y1, x0:x1]), hu=state['hu'])
+            if self.mask is not None and state['mask_on']:
+                if outline:
+                    # Borders depend on the neighbours, so look one pixel beyond the region
+                    my0, my1, mx0, mx1 = max(y0 - 1, 0), min(y1 + 1, h), max(x0 - 1, 0), min(x1 + 1, w)
+                    ring = label_outline(np.asarray(self.mask[z_index, my0:my1, mx0:mx1]))
+                    labels = ring[y0 - my0:y1 - my0, x0 - mx0:x1 - mx0]
+                else:
+                    labels = np.asarray(self.mask[z_index, y0:y1, x0:x1])
+            region = self.compose(gray, labels, state, (y1 - y0, x1 - x0))
+            # Frames handed out are never modified, so paste into a copy
+            im_pil = im_pil.copy()
+            im_pil.paste(region, (x0, y0))
+        return im_pil
 
-        opacity_factor = mask_opacity / 100.0
+    def compose(self, gray, labels, state, shape, overlay_box=None):
+        """
+        Build the displayed image from a windowed uint8 array `gray` and a label array `labels`
+        (None when not shown) of the given (height, width), according to the mask settings in `state`.
+        `overlay_box=(y0, y1, x0, x1)` limits the overlay to the region holding labels (empty: none).
+        """
+        mask_on = state['mask_on']
+        only_mask = state['only_mask']
+        opacity_factor = state['mask_opacity'] / 100.0
+        height, width = shape
+        timer = self.timer
 
         # Case 1: Mask is OFF but Only Mask is ON -> Return Blank
         if mask_on is False and only_mask:
-            return PILImage.new('RGBA', (self.img.shape[2], self.img.shape[1]), (0, 0, 0, 255))
+            return PILImage.new('RGBA', (width, height), (0, 0, 0, 255))
+
+        if labels is not None and not only_mask and gray.ndim == 2:
+            return self._blend(gray, labels, opacity_factor, overlay_box)
 
         # Case 2: Base Image Generation
         if not only_mask:
-            im_array = HU_to_gray(self.img[z_index], hu=hu)
-            if self.mask is not None and mask_on:
-                im_pil = PILImage.fromarray(im_array).convert('RGBA')
+            if labels is not None:
+                with timer.stage('convert'):
+                    im_pil = PILImage.fromarray(gray).convert('RGBA')
             else:
-                im_pil = PILImage.fromarray(im_array)
+                im_pil = PILImage.fromarray(gray)
         else:
             # Placeholder for 'only_mask' overlay base
-            im_pil = PILImage.new('RGBA', (self.img.shape[2], self.img.shape[1]), (0, 0, 0, 0))
+            im_pil = PILImage.new('RGBA', (width, height), (0, 0, 0, 0))
 
         # Case 3: Overlay Generation
-        if self.mask is not None and mask_on:
-            mask_slice = self.mask[z_index]
-            overlay = np.zeros((mask_slice.shape[0], mask_slice.shape[1], 4), dtype=np.uint8)
-
-            for label, organ in self.label_to_organ.items():
-                if label != 0 and organ in self.organ_to_color:
-                    rgba = self.organ_to_color[organ]
-                    mask_region = (mask_slice == label)
-                    overlay[mask_region] = rgba
-
-            overlay_pil = PILImage.fromarray(overlay, 'RGBA')
-
-            if only_mask:
+        if labels is not None:
+            palette = self.palette
+            if not only_mask and opacity_factor < 1.0:
+                # Scale the palette's alpha once instead of every overlay pixel (same float32 rounding)
+                palette = palette.copy()
+                palette[:, 3] = (palette[:, 3].astype(np.float32) * opacity_factor).astype(np.uint8)
+            if overlay_box is not None:
+                y0, y1, x0, x1 = overlay_box
+                if y0 >= y1 or x0 >= x1:
+                    return im_pil  # no labels: nothing to draw
+                labels = labels[y0:y1, x0:x1]
+            with timer.stage('overlay'):
+                overlay = labels_to_rgba(labels, palette)
+                overlay_pil = PILImage.fromarray(overlay, 'RGBA')
+
+            if overlay_box is not None:
+                # Only the labelled region is drawn; the rest keeps the base pixels
+                with timer.stage('composite'):
+                    if not only_mask:
+                        overlay_pil = PILImage.alpha_composite(im_pil.crop((x0, y0, x1, y1)), overlay_pil)
+                    im_pil.paste(overlay_pil, (x0, y0))
+            elif only_mask:
                 im_pil = overlay_pil
             else:
-                if opacity_factor < 1.0:
-                    overlay_array = np.array(overlay_pil, dtype=np.float32)
-                    overlay_array[..., 3] *= opacity_factor
-                    overlay_pil = PILImage.fromarray(overlay_array.astype(np.uint8), 'RGBA')
-
-                im_pil = PILImage.alpha_composite(im_pil, overlay_pil)
+                with timer.stage('composite'):
+                    im_pil = PILImage.alpha_composite(im_pil, overlay_pil)
         
         return im_pil
 
-    def save_animation(self, fn='animation.webp', z_lst=None):
+    def _blend(self, gray, labels, opacity_factor, overlay_box=None):
+        """Gray slice with the label overlay as an RGB image, through the fused BlendLUT kernel."""
+        timer = self.timer
+        palette = self.palette
+        if opacity_factor < 1.0:
+            # Same float32 rounding of the alpha as the PIL path
+            palette = palette.copy()
+            palette[:, 3] = (palette[:, 3].astype(np.float32) * opacity_factor).astype(np.uint8)
+        with timer.stage('overlay'):
+            out = self.blend_lut.buffer(gray.shape)
+            if overlay_box is None:
+                self.blend_lut(gray, labels, palette, out)
+            else:
+                # Outside the labelled region the frame is the gray slice
+                self.blend_lut(gray, None, palette, out)
+                y0, y1, x0, x1 = overlay_box
+                if y0 < y1 and x0 < x1:
+                    self.blend_lut(gray[y0:y1, x0:x1], labels[y0:y1, x0:x1], palette, out[y0:y1, x0:x1])
+        with timer.stage('convert'):
+            # frombytes decodes into the image's own memory (frombuffer would keep a view of
+            # the buffer), so returned frames stay valid when the buffer is reused
+            height, width = gray.shape
+            return PILImage.frombytes('RGB', (width, height), out, 'raw', 'RGBX')
+
+    def get_mosaic(self, step=None, cols=None, downsample=None, z_range=None, state=None, max_tiles=64, max_size=2048):
+        """
+        Render every `step`-th slice of `z_range` (default: the whole volume) as one grid image.
+        The strided sub-volume is read once and windowed, coloured and composited as a single
+        array. `step` defaults to roughly `max_tiles` tiles, `cols` to a square-ish grid and
+        `downsample` to the smallest factor keeping the mosaic within `max_size` pixels.
+        Returns (PIL image, MosaicLayout).
+        """
+        state = self.state if state is None else state
+        depth, height, width = self.img.shape[:3]
+        z0, z1 = z_range if z_range is not None else (0, depth)
+        if step is None:
+            step = max(1, math.ceil((z1 - z0) / max_tiles))
+        z_indices = tuple(range(z0, z1, step))
+        if not z_indices:
+            raise ValueError(f"empty mosaic: no slices in range({z0}, {z1}, {step})")
+        n = len(z_indices)
+        cols = cols or math.ceil(math.sqrt(n))
+        rows = math.ceil(n / cols)
+        if downsample is None:
+            downsample = max(1, math.ceil(max(cols * width, rows * height) / max_size))
+        ds = downsample
+        sub = np.s_[z0:z1:step, ::ds, ::ds]
+        layout = MosaicLayout(z_indices, rows, cols, -(-height // ds), -(-width // ds), ds)
+
+        gray = labels = None
+        timer = self.timer
+        if not state['only_mask']:
+            with timer.stage('extract'):
+                if state.get('slab_mode', 'none') == 'none':
+                    stack = self.img[sub]
+                else:
+                    stack = np.stack([self.image_slice(z, state)[::ds, ::ds] for z in z_indices])
+            with timer.stage('window'):
+                gray = _tile(self.window_lut(stack, hu=state['hu']), rows, cols)
+        if self.mask is not None and state['mask_on']:
+            with timer.stage('extract_mask'):
+                stack = np.asarray(self.mask[sub])
+                if state.get('overlay_mode', 'fill') == 'outline':
+                    stack = label_outline(stack)
+                labels = _tile(stack, rows, cols)
+        w, h = layout.size
+        return self.compose(gray, labels, state, (h, w)), layout
+
+    def save_animation(self, fn='animation.webp', z_lst=None, workers=None, progress=None):
         """
         Generates and saves an animation.
-        Restores internal state (z_index) when finished.
+        Frames are rendered from a snapshot of the current state in a worker pool and streamed
+        to the file, so memory stays bounded and `self.state` is never modified.
+        `progress(done, total)` is called after each written frame.
         """
-        if z_lst is None:
-            z_lst = range(self.img.shape[0])
-        
-        frames = []
-        original_z = self.state['z_index']  # Save State
-        
-        # Iterate and Generate
-        for z in z_lst:
-            self.update_state(z_index=z)
-            frames.append(self.get_image())
-            
-        save_PILlst_webp(frames, fn=fn, format='webp')
-        
-        # Restore State
-        self.update_state(z_index=original_z)
+        export_animation(self, fn, z_lst=z_lst, workers=workers, progress=progress)
+
+def _cine_prefetcher(slicer, viewer, depth):
+    """Look-ahead renderer for the cine axis of an N-D slicer (None for other slicers or depth 0)."""
+    axis = getattr(slicer, 'cine_axis', None)
+    if axis is None or not depth:
+        return None
+    return SlicePrefetcher(slicer, viewer, depth=depth, axis=f'{axis}_index', wrap=True)
+
 
 class DicomWidget:
     """A widget for interactively displaying DICOM slices with HU windowing.
     This base widget relies on simple ipywidgets and has NO dependencies on ipyevents."""
 
-    def __init__(self, image_array, mask=None, origin=None, spacing=None, label_to_organ=None, organ_to_color=None):
+    def __init__(self, image_array, mask=None, origin=None, spacing=None, label_to_organ=None, organ_to_color=None,
+                 frame_cache=None, prefetch=0, async_render=False, slicer=None, cine_preload=8):
         
-        # Initialize the Logic Engine
-        self.slicer = DicomSlicer(image_array, mask=mask, origin=origin, spacing=spacing,
-                                  label_to_organ=label_to_organ, organ_to_color=organ_to_color)
+        # Initialize the Logic Engine (or use a ready slicer with the same contract, e.g. a CPRSlicer)
+        if slicer is None:
+            slicer = DicomSlicer(image_array, mask=mask, origin=origin, spacing=spacing,
+                                 label_to_organ=label_to_organ, organ_to_color=organ_to_color)
+        self.slicer = slicer
+        self.slicer.frame_cache = frame_cache
         
         # UI Components
         from .viewers import SimpleImageViewer
@@ -197,7 +770,15 @@ class DicomWidget:
         
         initial_img = self.slicer.get_image()
         self.viewer = SimpleImageViewer(width=initial_img.width, height=initial_img.height)
-        self.controls = DicomControls(max_z=image_array.shape[0]-1, on_change=self._on_controls_change)
+        # Optional background rendering of the next `prefetch` slices
+        self.prefetcher = SlicePrefetcher(self.slicer, self.viewer, depth=prefetch) if prefetch else None
+        self.cine = _cine_prefetcher(self.slicer, self.viewer, cine_preload)
+        # Optional latest-wins rendering on a background thread (drops stale frames)
+        self.scheduler = RenderScheduler(self._show) if async_render else None
+        self.mosaic = None  # MosaicLayout while a mosaic is shown
+        self.controls = DicomControls(max_z=self.slicer.state['z_index_max'], on_change=self._on_controls_change,
+                                      axes=getattr(self.slicer, 'axis_sizes', None),
+                                      cine_axis=getattr(self.slicer, 'cine_axis', None))
         
         self.widget = widgets.HBox([self.viewer.widget, self.controls.widget])
         
@@ -207,13 +788,7 @@ class DicomWidget:
         self.BoneWindow = wl2range(1800, 400)
         
         # Sync Initial State
-        self._on_controls_change({
-            'z_index': self.controls.z_index.value,
-            'hu': self.controls.hu.value,
-            'mask_opacity': self.controls.mask_opacity.value,
-            'mask_on': self.controls.mask_on.value,
-            'only_mask': self.controls.only_mask.value
-        })
+        self._on_controls_change(self.controls.get_state())
 
     # --- Backwards Compatibility Properties ---
     @property
@@ -230,10 +805,25 @@ class DicomWidget:
     def im_w(self): return self.viewer.image_widget
 
     # --- State Handling ---
+    def _render(self, interactive=False):
+        """Push the slicer's current frame to the viewer (through the frame cache if enabled)."""
+        self.mosaic = None
+        if self.scheduler is not None:
+            self.scheduler.request(self.slicer.state, interactive)
+        else:
+            self._show(dict(self.slicer.state), interactive)
+
+    def _show(self, state, interactive):
+        show_frame(self.slicer, self.viewer, interactive=interactive, state=state)
+        if self.prefetcher is not None:
+            self.prefetcher.notify(state)
+        if self.cine is not None:
+            self.cine.notify(state)
+
     def _on_controls_change(self, state_dict):
         """Called when UI controls are changed."""
         self.slicer.update_state(**state_dict)
-        self.viewer.set_image(self.slicer.get_image())
+        self._render(interactive=True)
 
     @contextmanager
     def ignore_updates(self):
@@ -247,18 +837,18 @@ class DicomWidget:
     def set_widget_value(self, widget_obj, new_val):
         """Generic backend function to safely update any widget programmatically."""
         # Find which key this widget represents and update it via update_silently
-        for k in ['z_index', 'hu', 'mask_opacity', 'mask_on', 'only_mask']:
+        for k in self.controls.get_state():
             if getattr(self.controls, k) is widget_obj:
                 self.controls.update_silently(**{k: new_val})
                 return
 
-    def _update_image(self, z_index, hu, mask_opacity, mask_on, only_mask):
+    def _update_image(self, z_index, hu, mask_opacity, mask_on, only_mask, interactive=False):
         """Compatibility method for external interaction classes."""
         self.slicer.update_state(
             z_index=z_index, hu=hu, mask_opacity=mask_opacity,
             mask_on=mask_on, only_mask=only_mask
         )
-        self.viewer.set_image(self.slicer.get_image())
+        self._render(interactive=interactive)
 
     def set_slice(self, z):
         self.controls.update_silently(z_index=z)
@@ -270,21 +860,60 @@ class DicomWidget:
         from IPython.display import display
         display(self.widget)
 
+    def undo(self):
+        """Undo the last mask edit and show the result."""
+        if self.slicer.undo():
+            self._render()
+
+    def redo(self):
+        if self.slicer.redo():
+            self._render()
+
+    def show_mosaic(self, step=None, cols=None, downsample=None, **kwargs):
+        """
+        Show a grid of every `step`-th slice with the current settings (see `DicomSlicer.get_mosaic`)
+        in a single encode. Any control change returns to the slice view. Returns the MosaicLayout.
+        """
+        im_pil, self.mosaic = self.slicer.get_mosaic(step=step, cols=cols, downsample=downsample,
+                                                     state=dict(self.slicer.state), **kwargs)
+        self.viewer.set_image(im_pil)
+        return self.mosaic
+
+    def enable_timing(self, window=256):
+        """Record per-stage render/encode timings; returns the StageTimer (see `StageTimer.stats()`)."""
+        timer = StageTimer(window=window)
+        self.slicer.timer = timer
+        self.viewer.timer = timer
+        return timer
+
+    def disable_timing(self):
+        self.slicer.timer = NULL_TIMER
+        self.viewer.timer = NULL_TIMER
+
     def add_mask(self, mask_array, label_to_organ, organ_to_color):
+        mask_array = as_volume(mask_array)
         if mask_array.shape != self.slicer.img.shape:
             raise ValueError("Mask array shape must match image array shape.")
         self.slicer.set_data(self.slicer.img, mask_array)
         self.slicer.set_mask_mappings(label_to_organ, organ_to_color)
-        self.viewer.set_image(self.slicer.get_image())
+        self._render()
 
     def update_case(self, image, mask=None):
         self.slicer.set_data(image, mask)
-        max_z = image.shape[0] - 1
+        max_z = self.slicer.img.shape[0] - 1
         self.controls.z_index.max = max_z
         if self.controls.z_index.value > max_z:
              self.controls.update_silently(z_index=0)
              self.slicer.update_state(z_index=0)
-        self.viewer.set_image(self.slicer.get_image())
+        # Extra axes of an N-D slicer start again at index 0 (see NDSlicer.set_data)
+        with self.ignore_updates():
+            for key in self.controls.axis_keys:
+                slider = getattr(self.controls, key)
+                slider.value = 0
+                slider.max = self.slicer.state[key + '_max']
+                if key == self.controls.cine_key:
+                    self.controls.play.max = slider.max
+        self._render()
 
     def save_frame(self, output_fn=None):
         format = self.viewer.format
@@ -0,0 +1,134 @@
+"""
+Streaming animation export.
+
+Frames are rendered from state snapshots and encoded as single-frame WebPs in a thread
+pool, then muxed in order into an animated WebP (RIFF/ANMF container) as they complete.
+At most `max_pending` frames are in flight, so memory does not grow with the number of
+slices, and the slicer's live state is never touched.
+"""
+import io
+import os
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _u24(v):
+    return struct.pack('<I', v)[:3]
+
+
+def _chunk(fourcc, payload):
+    data = fourcc + struct.pack('<I', len(payload)) + payload
+    return data + b'\0' if len(payload) % 2 else data
+
+
+class WebPAnimationWriter:
+    """
+    Writes an animated WebP frame by frame from already encoded single-frame WebPs.
+
+        with WebPAnimationWriter('out.webp', (w, h), duration=100) as writer:
+            for data in encoded_frames:
+                writer.add_encoded(data)
+    """
+    def __init__(self, fn, size, duration=100, loop=0, background=(0, 0, 0, 0)):
+        self.size = size
+        self.duration = duration
+        self.frames = 0
+        self._has_alpha = False
+        self._f = open(fn, 'wb')
+        w, h = size
+        self._f.write(b'RIFF\0\0\0\0WEBP')
+        self._vp8x_pos = self._f.tell()
+        self._f.write(_chunk(b'VP8X', bytes([0x02]) + b'\0\0\0' + _u24(w - 1) + _u24(h - 1)))
+        r, g, b, a = background
+        self._f.write(_chunk(b'ANIM', bytes([b, g, r, a]) + struct.pack('<H', loop)))
+
+    @staticmethod
+    def _image_chunks(data):
+        """Split a still WebP into its image chunks (ALPH/VP8/VP8L), dropping VP8X and metadata."""
+        if data[:4] != b'RIFF' or data[8:12] != b'WEBP':
+            raise ValueError("not a WebP image")
+        pos, end = 12, len(data)
+        chunks = []
+        while pos + 8 <= end:
+            fourcc = data[pos:pos + 4]
+            size = struct.unpack('<I', data[pos + 4:pos + 8])[0]
+            if fourcc in (b'ALPH', b'VP8 ', b'VP8L'):
+                chunks.append((fourcc, data[pos:pos + 8 + size + (size & 1)]))
+            pos += 8 + size + (size & 1)
+        return chunks
+
+    def add_encoded(self, data, duration=None):
+        chunks = self._image_chunks(data)
+        if any(fourcc in (b'ALPH', b'VP8L') for fourcc, _ in chunks):
+            self._has_alpha = True
+        w, h = self.size
+        duration = self.duration if duration is None else duration
+        # Frame at (0, 0), full canvas, no blending with the previous frame, no disposal
+        header = _u24(0) + _u24(0) + _u24(w - 1) + _u24(h - 1) + _u24(int(duration)) + bytes([0x02])
+        self._f.write(_chunk(b'ANMF', header + b''.join(c for _, c in chunks)))
+        self.frames += 1
+
+    def close(self):
+        if self._f.closed:
+            return
+        end = self._f.tell()
+        self._f.seek(4)
+        self._f.write(struct.pack('<I', end - 8))
+        if self._has_alpha:
+            self._f.seek(self._vp8x_pos + 8)
+            self._f.write(bytes([0x02 | 0x10]))
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def encode_webp(pil_img, quality=95, method=0):
+    buf = io.BytesIO()
+    pil_img.save(buf, format='webp', quality=quality, method=method)
+    return buf.getvalue()
+
+
+def export_animation(slicer, fn, z_lst=None, state=None, workers=None, max_pending=None,
+                     duration=100, quality=95, progress=None):
+    """
+    Render `z_lst` (default: all slices) of `slicer` with the settings of `state`
+    (default: a snapshot of the current state) into an animated WebP at `fn`.
+    `progress(done, total)` is called after each written frame. Returns the number of frames.
+    """
+    base = dict(slicer.state if state is None else state)
+    z_lst = list(range(slicer.img.shape[0]) if z_lst is None else z_lst)
+    if not z_lst:
+        return 0
+    workers = workers or min(8, os.cpu_count() or 1)
+    max_pending = max_pending or 2 * workers
+    total = len(z_lst)
+
+    def job(z):
+        return encode_webp(slicer.get_image(dict(base, z_index=z)), quality=quality)
+
+    size = slicer.get_image(dict(base, z_index=z_lst[0])).size
+    writer = WebPAnimationWriter(fn, size, duration=duration)
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='liteviz-export') as pool:
+            pending = deque()
+            todo = iter(z_lst)
+            for z in todo:
+                pending.append(pool.submit(job, z))
+                if len(pending) >= max_pending:
+                    break
+            while pending:
+                writer.add_encoded(pending.popleft().result())
+                if progress is not None:
+                    progress(writer.frames, total)
+                z = next(todo, None)
+                if z is not None:
+                    pending.append(pool.submit(job, z))
+    finally:
+        writer.close()
+    return writer.frames
@@ -0,0 +1,110 @@
+import threading
+from collections import OrderedDict
+
+
+class FrameCache:
+    """
+    Bounded LRU cache of encoded frames (bytes), keyed by slicer state + encoder settings.
+    Attach it to a DicomSlicer (`slicer.frame_cache = FrameCache(...)`) to enable it;
+    the slicer drops entries when its data or mask changes.
+    """
+    def __init__(self, max_bytes=128 * 2**20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __contains__(self, key):
+        return key in self._frames
+
+    def get(self, key):
+        with self._lock:
+            data = self._frames.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._frames.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._frames.pop(key, None)
+            if old is not None:
+                self.nbytes -= len(old)
+            self._frames[key] = data
+            self.nbytes += len(data)
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._frames.popitem(last=False)
+                self.nbytes -= len(evicted)
+
+    def discard_slice(self, z_index):
+        """Drop every frame rendered from slice `z_index` (keys start with the z index)."""
+        with self._lock:
+            for key in [k for k in self._frames if k[0] == z_index]:
+                self.nbytes -= len(self._frames.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'frames': len(self._frames),
+            'nbytes': self.nbytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+def render_encoded(slicer, viewer, state=None, interactive=False, live=False):
+    """
+    Return `(data, is_interactive)`: the encoded bytes of the slicer's frame for `state`
+    (default: current state), going through its frame cache if any.
+
+    With `interactive=True` the viewer's cheap encoder settings are used, unless a
+    full-quality frame is already cached; `is_interactive` tells which one was returned.
+    `live` is passed on to `slicer.get_image` (True only for the displayed frame).
+    """
+    cache = getattr(slicer, 'frame_cache', None)
+    if cache is None:
+        return viewer.encode(slicer.get_image(state, live=live), interactive), interactive
+    frame_key = slicer.frame_key(state)
+    data = cache.get(frame_key + viewer.encoder_key)
+    if data is not None:
+        return data, False
+    if interactive:
+        key = frame_key + viewer.encoding.key(True)
+        data = cache.get(key)
+        if data is not None:
+            return data, True
+    else:
+        key = frame_key + viewer.encoder_key
+    data = viewer.encode(slicer.get_image(state, live=live), interactive)
+    cache.put(key, data)
+    return data, interactive
+
+
+def show_frame(slicer, viewer, interactive=False, state=None):
+    """
+    Render (or fetch) the slicer's frame for `state` (default: current state) and push it to
+    the viewer. Interactive frames use the viewer's cheap encoder settings and get a
+    full-quality refresh once idle.
+    """
+    state = dict(slicer.state) if state is None else state
+    data, is_interactive = render_encoded(slicer, viewer, state, interactive=interactive, live=True)
+    refresh = None
+    if is_interactive:
+        refresh = lambda: render_encoded(slicer, viewer, state)[0]
+    viewer.set_encoded(data, is_interactive, refresh)
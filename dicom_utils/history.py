@@ -0,0 +1,147 @@
+"""
+Undo/redo history for mask edits.
+
+Each operation (a brush stroke, a callback edit, ...) is stored as sparse per-slice deltas:
+the flat indices of the changed pixels within the slice plus their old and new labels, so
+memory and undo/redo time follow the size of the edit, not of the volume.
+"""
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class SliceDelta:
+    """Changed pixels of one slice: flat indices (row-major, `width` columns), old and new labels."""
+    __slots__ = ('z', 'index', 'old', 'new', 'width')
+
+    def __init__(self, z, index, old, new, width):
+        self.z = z
+        self.index = index
+        self.old = old
+        self.new = new  # array, or a scalar when all pixels got the same label
+        self.width = width
+
+    @property
+    def nbytes(self):
+        return self.index.nbytes + self.old.nbytes + np.asarray(self.new).nbytes
+
+    def coords(self):
+        return np.divmod(self.index, self.width)
+
+    def apply(self, mask, values):
+        """Write `values` at the delta's pixels; returns the touched bbox (y0, y1, x0, x1)."""
+        ys, xs = self.coords()
+        mask[self.z, ys, xs] = values
+        return int(ys.min()), int(ys.max()) + 1, int(xs.min()), int(xs.max()) + 1
+
+
+class EditHistory:
+    """
+    Bounded undo/redo stacks of mask edit operations.
+
+        history.record(z, ys, xs, old, new)   # one operation
+        with history.operation():             # several records undone together
+            ...
+        history.undo(mask)                    # -> [(z, bbox), ...] of restored regions
+
+    When the stored deltas exceed `max_bytes`, the oldest operations are dropped.
+    """
+    def __init__(self, max_bytes=64 * 2**20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._undo = deque()
+        self._redo = []
+        self._open = None  # operation being recorded by begin()/end()
+        self._depth = 0
+
+    @property
+    def can_undo(self):
+        return bool(self._undo)
+
+    @property
+    def can_redo(self):
+        return bool(self._redo)
+
+    def __len__(self):
+        return len(self._undo)
+
+    def begin(self):
+        """Start grouping records into one operation (nestable; closed by the matching `end`)."""
+        if self._depth == 0:
+            self._open = []
+        self._depth += 1
+
+    def end(self):
+        if self._depth == 0:
+            return
+        self._depth -= 1
+        if self._depth == 0:
+            op, self._open = self._open, None
+            if op:
+                self._push(op)
+
+    @contextmanager
+    def operation(self):
+        self.begin()
+        try:
+            yield self
+        finally:
+            self.end()
+
+    def record(self, z, ys, xs, old, new, width):
+        """
+        Record that pixels (ys, xs) of slice z (`width` columns) changed from `old` to `new`.
+        Pixels whose label did not change are not stored.
+        """
+        ys, xs = np.asarray(ys).ravel(), np.asarray(xs).ravel()
+        old = np.asarray(old).ravel()
+        scalar = np.ndim(new) == 0
+        new = np.asarray(new, dtype=old.dtype) if scalar else np.asarray(new, dtype=old.dtype).ravel()
+        changed = old != new
+        if not changed.any():
+            return
+        if not changed.all():
+            ys, xs, old = ys[changed], xs[changed], old[changed]
+            if not scalar:
+                new = new[changed]
+        index_dtype = np.uint32 if (int(ys.max()) + 1) * width <= 2**32 else np.intp
+        index = ys.astype(index_dtype) * index_dtype(width) + xs.astype(index_dtype)
+        delta = SliceDelta(int(z), index, old, new, width)
+        if self._open is not None:
+            self._open.append(delta)
+        else:
+            self._push([delta])
+
+    def _push(self, op):
+        self._undo.append(op)
+        self.nbytes += sum(d.nbytes for d in op)
+        for dropped in self._redo:
+            self.nbytes -= sum(d.nbytes for d in dropped)
+        self._redo = []
+        while self.nbytes > self.max_bytes and len(self._undo) > 1:
+            self.nbytes -= sum(d.nbytes for d in self._undo.popleft())
+
+    def undo(self, mask):
+        """Revert the last operation in `mask`; returns [(z, bbox), ...] or None if there is nothing to undo."""
+        if not self._undo:
+            return None
+        op = self._undo.pop()
+        # Reverse order, so pixels touched twice end up with their first old value
+        touched = [(d.z, d.apply(mask, d.old)) for d in reversed(op)]
+        self._redo.append(op)
+        return touched
+
+    def redo(self, mask):
+        """Re-apply the last undone operation; returns [(z, bbox), ...] or None."""
+        if not self._redo:
+            return None
+        op = self._redo.pop()
+        touched = [(d.z, d.apply(mask, d.new)) for d in op]
+        self._undo.append(op)
+        return touched
+
+    def clear(self):
+        self._undo.clear()
+        self._redo = []
+        self.nbytes = 0
@@ -1,13 +1,19 @@
 import ipywidgets as widgets
 from .viewers import InteractiveImageViewer, SimpleImageViewer
 from .controls import DicomControls
-from .dicom_utils import DicomSlicer
+from .dicom_utils import DicomSlicer, _cine_prefetcher
+from .frame_cache import show_frame
+from .prefetch import SlicePrefetcher
+from .scheduler import RenderScheduler
+from .profiling import StageTimer, NULL_TIMER
+from .viewport import Viewport, display_to_source
 
 class InteractiveDicomWidget:
     """An advanced widget for interactively displaying DICOM slices,
     combining a DicomSlicer, UI controls, and an InteractiveImageViewer."""
 
-    def __init__(self, dicom_slicer=None, image_array=None, mask=None, fps=20, show_status=True, **kwargs):
+    def __init__(self, dicom_slicer=None, image_array=None, mask=None, fps=20, show_status=True, frame_cache=None, prefetch=0,
+                 preview_size=512, async_render=False, max_display=None, cine_preload=8, **kwargs):
         
         # 1. Init Slicer (Math/Data Block)
         if dicom_slicer:
@@ -16,11 +22,20 @@ class InteractiveDicomWidget:
             self.slicer = DicomSlicer(image_array, mask=mask, **kwargs)
         else:
             raise ValueError("Must provide either a dicom_slicer or an image_array.")
+        if frame_cache is not None:
+            self.slicer.frame_cache = frame_cache
             
         # 2. Init UI Controls
-        self.controls = DicomControls(max_z=self.slicer.state['z_index_max'], on_change=self._on_controls_change)
+        self.controls = DicomControls(max_z=self.slicer.state['z_index_max'], on_change=self._on_controls_change,
+                                      axes=getattr(self.slicer, 'axis_sizes', None),
+                                      cine_axis=getattr(self.slicer, 'cine_axis', None))
         
         # 3. Init Viewer
+        # Zoom/pan (Ctrl+wheel, middle drag); slices larger than `max_display` are shown scaled to fit
+        h, w = self.slicer.img.shape[1:3]
+        fit = min(1.0, max_display / max(h, w)) if max_display else 1.0
+        self.viewport = Viewport((h, w), (max(1, round(h * fit)), max(1, round(w * fit))))
+        self.slicer.update_state(viewport=self.viewport.state())
         init_img = self.slicer.get_image()
         self.viewer = InteractiveImageViewer(
             width=init_img.width, 
@@ -28,17 +43,29 @@ class InteractiveDicomWidget:
             fps=fps,
             show_status=show_status
         )
+        # Optional background rendering of the next `prefetch` slices
+        self.prefetcher = SlicePrefetcher(self.slicer, self.viewer, depth=prefetch) if prefetch else None
+        self.cine = _cine_prefetcher(self.slicer, self.viewer, cine_preload)
+        # Optional latest-wins rendering on a background thread (drops stale frames)
+        self.scheduler = RenderScheduler(self._show) if async_render else None
         
         # 4. Wire Viewer Events to Logic
         self.viewer.on_scroll = self._handle_scroll
         self.viewer.on_drag_start = self._handle_drag_start
         self.viewer.on_drag = self._handle_drag
+        self.viewer.on_drag_end = self._handle_drag_end
         self.viewer.on_hover = self._handle_hover
         self.viewer.on_keydown = self._handle_keydown
+        self.viewer.on_click = self._handle_click
+        self.viewer.on_zoom = self._handle_zoom
+        self.viewer.on_pan = self._handle_pan
         
         # State
         self.wl_sens = 1
         self.hu0 = self.slicer.state['hu']
+        self.preview_size = preview_size  # max side of W/L drag previews (None: full resolution)
+        self.mosaic = None  # MosaicLayout while a mosaic is shown
+        self.nav_label = None  # label the n/p keys jump to (None: any label)
         
         # Layout
         self.widget = widgets.HBox([self.viewer.widget, self.controls.widget])
@@ -49,21 +76,85 @@ class InteractiveDicomWidget:
     def display(self):
         from IPython.display import display
         display(self.widget)
+
+    def jump_to_label(self, label=None, direction=1):
+        """
+        Go to the nearest slice after (`direction=1`) or before (`-1`) the current one containing
+        `label` (int, IntEnum member or organ name; default: `nav_label`). Returns the slice or None.
+        """
+        label = self.nav_label if label is None else label
+        z = self.slicer.next_slice_with(label, direction)
+        name = 'any label' if label is None else getattr(label, 'name', label)
+        if z is None:
+            self.viewer.update_status(f"No {'next' if direction > 0 else 'previous'} slice with {name}")
+            return None
+        self.controls.update_silently(z_index=z)
+        self._sync_state()
+        self.viewer.update_status(f"Slice: {z} | {name}")
+        return z
+
+    def undo(self):
+        """Undo the last mask edit (Ctrl+Z) and show the result."""
+        if self.slicer.undo():
+            self._render()
+            self.viewer.update_status("Undo")
+
+    def redo(self):
+        """Redo the last undone mask edit (Ctrl+Y or Ctrl+Shift+Z)."""
+        if self.slicer.redo():
+            self._render()
+            self.viewer.update_status("Redo")
+
+    def show_mosaic(self, step=None, cols=None, downsample=None, **kwargs):
+        """
+        Show a grid of every `step`-th slice (see `DicomSlicer.get_mosaic`). Clicking a tile
+        jumps to that slice; Escape, scrolling or any control change returns to the slice view.
+        """
+        im_pil, self.mosaic = self.slicer.get_mosaic(step=step, cols=cols, downsample=downsample,
+                                                     state=dict(self.slicer.state), **kwargs)
+        self.viewer.set_image(im_pil)
+        self.viewer.update_status(f"Mosaic: {len(self.mosaic.z_indices)} slices | click a tile to open it")
+        return self.mosaic
+
+    def _mosaic_z(self, x, y):
+        """Slice under viewer coordinates (x, y) of the shown mosaic (the viewer scales it to its size)."""
+        w, h = self.mosaic.size
+        return self.mosaic.z_at(x * w / self.viewer.width, y * h / self.viewer.height)
+
+    def enable_timing(self, window=256, show_in_status=True):
+        """Record per-stage render/encode timings; returns the StageTimer (see `StageTimer.stats()`)."""
+        timer = StageTimer(window=window)
+        self.slicer.timer = timer
+        self.viewer.timer = timer
+        self.viewer.show_timing = show_in_status
+        return timer
+
+    def disable_timing(self):
+        self.slicer.timer = NULL_TIMER
+        self.viewer.timer = NULL_TIMER
         
-    def _sync_state(self):
-        state_dict = {
-            'z_index': self.controls.z_index.value,
-            'hu': self.controls.hu.value,
-            'mask_opacity': self.controls.mask_opacity.value,
-            'mask_on': self.controls.mask_on.value,
-            'only_mask': self.controls.only_mask.value
-        }
-        self.slicer.update_state(**state_dict)
-        self.viewer.set_image(self.slicer.get_image())
+    def _sync_state(self, interactive=False):
+        self.slicer.update_state(**self.controls.get_state())
+        self._render(interactive=interactive)
+
+    def _render(self, interactive=False):
+        """Push the slicer's current frame to the viewer (through the frame cache if enabled)."""
+        self.mosaic = None
+        if self.scheduler is not None:
+            self.scheduler.request(self.slicer.state, interactive)
+        else:
+            self._show(dict(self.slicer.state), interactive)
+
+    def _show(self, state, interactive):
+        show_frame(self.slicer, self.viewer, interactive=interactive, state=state)
+        if self.prefetcher is not None:
+            self.prefetcher.notify(state)
+        if self.cine is not None:
+            self.cine.notify(state)
 
     def _on_controls_change(self, state_dict):
         self.slicer.update_state(**state_dict)
-        self.viewer.set_image(self.slicer.get_image())
+        self._render(interactive=True)
         self.viewer.update_status(f"Slice: {state_dict['z_index']} | W/L: {state_dict['hu']}")
 
     # --- Event Handlers (Mapping UI actions to Slicer Math) ---
@@ -74,12 +165,20 @@ class InteractiveDicomWidget:
         new_z = max(0, min(self.slicer.state['z_index_max'], current_z + step))
         if new_z != current_z:
             self.controls.update_silently(z_index=new_z)
-            self._sync_state()
+            self._sync_state(interactive=True)
             self.viewer.update_status(f"Slice: {new_z}/{self.slicer.state['z_index_max']}")
 
     def _handle_drag_start(self, x, y, button):
         if button == 2:  # Right click
             self.hu0 = self.slicer.state['hu']
+            if self.preview_size:
+                # Render downsampled frames while windowing; the browser scales them up
+                self.slicer.update_state(lod=self.slicer.preview_lod(self.preview_size))
+
+    def _handle_drag_end(self, button):
+        if self.slicer.state['lod'] != 1:
+            self.slicer.update_state(lod=1)
+            self._render()
 
     def _handle_drag(self, dx, dy, button):
         if button == 2:  # Right click -> Window/Level
@@ -91,12 +190,50 @@ class InteractiveDicomWidget:
             
             # Update controls silently, then sync
             self.controls.update_silently(hu=(new_a, new_b))
-            self._sync_state()
+            self._sync_state(interactive=True)
             self.viewer.update_status(f"W/L: {new_a}, {new_b}")
 
+    def _apply_viewport(self, interactive=True):
+        self.slicer.update_state(viewport=self.viewport.state())
+        self._render(interactive=interactive)
+        self.viewer.update_status(f"Zoom: {self.viewport.zoom:.2f}x")
+
+    def _handle_zoom(self, delta, x, y):
+        if self.mosaic is not None:
+            return
+        self.viewport.zoom_at(1.25 if delta < 0 else 0.8, x, y)
+        self._apply_viewport()
+
+    def _handle_pan(self, dx, dy):
+        if self.mosaic is not None:
+            return
+        self.viewport.pan(dx, dy)
+        self._apply_viewport()
+
+    def reset_view(self):
+        """Show the whole slice again (also the 0 key)."""
+        self.viewport.reset()
+        self._apply_viewport(interactive=False)
+
+    def _handle_click(self, x, y, button):
+        if self.mosaic is None or button != 0:
+            return
+        z = self._mosaic_z(x, y)
+        if z is not None:
+            self.controls.update_silently(z_index=z)
+            self._sync_state()
+            self.viewer.update_status(f"Slice: {z}")
+
     def _handle_hover(self, x, y):
+        if self.mosaic is not None:
+            z = self._mosaic_z(x, y)
+            self.viewer.update_status(f"Mosaic | Slice: {z if z is not None else '-'}")
+            return
+        # Viewer pixels -> slice pixels (zoomed/panned or scaled-to-fit views)
+        x, y = display_to_source(self.slicer.state.get('viewport'), x, y)
+        h, w = self.slicer.img.shape[1:3]
         try:
-            val = self.slicer.get_value_at_jk(y, x)
+            val = self.slicer.get_value_at_jk(y, x) if 0 <= y < h and 0 <= x < w else 'N/A'
         except Exception:
             val = 'N/A'
         self.viewer.update_status(f"Hover: ({x}, {y}) | Val: {val}")
@@ -110,6 +247,27 @@ class InteractiveDicomWidget:
             new_z = min(max_z, current_z + 1)
         elif key == 'ArrowDown':
             new_z = max(0, current_z - 1)
+        elif self.viewer.key_modifiers & {'ctrl', 'meta'} and key in ('z', 'y', 'Z'):
+            if key == 'z':
+                self.undo()
+            else:
+                self.redo()
+            return
+        elif key == '0':
+            self.reset_view()
+            return
+        elif key == 'o':
+            mode = 'fill' if self.slicer.state.get('overlay_mode') == 'outline' else 'outline'
+            self.controls.update_silently(overlay_mode=mode)
+            self._sync_state()
+            self.viewer.update_status(f"Overlay: {mode}")
+            return
+        elif key in ('n', 'p'):
+            self.jump_to_label(direction=1 if key == 'n' else -1)
+            return
+        elif key == 'Escape' and self.mosaic is not None:
+            self._sync_state()
+            return
         elif key == 'm':
             new_mask = not self.slicer.state['mask_on']
             self.controls.update_silently(mask_on=new_mask)
@@ -119,7 +277,7 @@ class InteractiveDicomWidget:
 
         if new_z != current_z:
             self.controls.update_silently(z_index=new_z)
-            self._sync_state()
+            self._sync_state(interactive=True)
             self.viewer.update_status(f"Slice: {new_z}")
 
 # Aliases for backwards compatibility
@@ -0,0 +1,140 @@
+"""
+Per-slice index of the labels in a mask volume.
+
+For every slice and label it records the pixel count and the 2D bounding box, computed
+with a few bincounts per chunk of slices instead of one pass per label. Labels are mapped
+to compact column ids first, so memory follows the number of distinct labels, not their
+values (e.g. sparse uint16 instance ids or negative labels). Edited slices are marked stale
+and recomputed on the next query.
+"""
+import threading
+
+import numpy as np
+
+
+class LabelIndex:
+    """
+        index = LabelIndex(mask)
+        index.slices_with(12)           # slices containing label 12
+        index.next_slice(12, z, +1)     # next one after z (None if there is none)
+        index.bbox(z, 12)               # (y0, y1, x0, x1) or None
+    """
+    def __init__(self, mask, chunk=8):
+        self.mask = mask
+        self.chunk = chunk
+        depth, self.height, self.width = mask.shape[:3]
+        self.n_labels = 1
+        self.values = np.zeros(1, dtype=np.int64)  # label of each column; column 0 is background 0
+        self._columns = {0: 0}  # label -> column
+        self.counts = np.zeros((depth, 1), dtype=np.int64)
+        self.bboxes = np.full((depth, 1, 4), -1, dtype=np.int32)
+        self._stale = set()
+        self._lock = threading.RLock()
+        for z0 in range(0, depth, chunk):
+            self._index(z0, np.asarray(mask[z0:z0 + chunk]))
+
+    def _column_of(self, values):
+        """Columns of the label `values`, adding columns for labels not seen before."""
+        new = [int(v) for v in values if int(v) not in self._columns]
+        if new:
+            depth = self.counts.shape[0]
+            for v in new:
+                self._columns[v] = len(self._columns)
+            self.counts = np.concatenate([self.counts, np.zeros((depth, len(new)), dtype=np.int64)], axis=1)
+            self.bboxes = np.concatenate([self.bboxes, np.full((depth, len(new), 4), -1, dtype=np.int32)], axis=1)
+            self.values = np.concatenate([self.values, np.array(new, dtype=np.int64)])
+            self.n_labels += len(new)
+        return np.array([self._columns[int(v)] for v in values], dtype=np.intp)
+
+    def _index(self, z0, planes):
+        """Counts and bboxes of slices z0..z0+len(planes) from their label arrays."""
+        n, h, w = planes.shape
+        if not planes.size:
+            return
+        lo, hi = int(planes.min()), int(planes.max())
+        if lo >= 0 and hi < 1024:
+            # Small non-negative labels are their own compact ids
+            values, ids = np.arange(hi + 1), planes.astype(np.intp, copy=False)
+        else:
+            values, ids = np.unique(planes, return_inverse=True)
+            ids = ids.reshape(planes.shape)
+        L = len(values)
+        # Per (slice, label): pixel counts, and which rows / columns contain the label
+        key = ids + (np.arange(n) * L)[:, None, None]
+        counts = np.bincount(key.ravel(), minlength=n * L).reshape(n, L)
+        rows = np.bincount((key * h + np.arange(h)[None, :, None]).ravel(), minlength=n * L * h).reshape(n, L, h) > 0
+        cols = np.bincount((key * w + np.arange(w)[None, None, :]).ravel(), minlength=n * L * w).reshape(n, L, w) > 0
+        present = counts > 0
+        bboxes = np.stack([rows.argmax(2), h - rows[..., ::-1].argmax(2),
+                           cols.argmax(2), w - cols[..., ::-1].argmax(2)], axis=-1).astype(np.int32)
+        bboxes[~present] = -1
+        # Only labels occurring in these slices get (or keep) a column
+        found = present.any(axis=0)
+        columns = self._column_of(values[found])
+        self.counts[z0:z0 + n] = 0
+        self.bboxes[z0:z0 + n] = -1
+        self.counts[z0:z0 + n, columns] = counts[:, found]
+        self.bboxes[z0:z0 + n, columns] = bboxes[:, found]
+
+    def invalidate(self, z_index=None):
+        """Mark slice `z_index` (None: all slices) as changed; it is re-indexed when next queried."""
+        with self._lock:
+            if z_index is None:
+                self._stale.update(range(self.counts.shape[0]))
+            else:
+                self._stale.add(int(z_index))
+
+    def is_stale(self, z_index):
+        return z_index in self._stale
+
+    def _refresh(self):
+        # Called with the lock held
+        while self._stale:
+            z = self._stale.pop()
+            self._index(z, np.asarray(self.mask[z])[None])
+
+    def labels_in(self, z_index):
+        """Labels (excluding background 0) present on slice `z_index`."""
+        with self._lock:
+            self._refresh()
+            return np.sort(self.values[np.flatnonzero(self.counts[z_index, 1:]) + 1])
+
+    def slices_with(self, label):
+        with self._lock:
+            self._refresh()
+            column = self._columns.get(int(label))
+            if column is None:
+                return np.empty(0, dtype=np.intp)
+            return np.flatnonzero(self.counts[:, column])
+
+    def next_slice(self, label, z_index, direction=1):
+        """Nearest slice after (`direction=1`) or before (`-1`) `z_index` containing `label`, or None."""
+        zs = self.slices_with(label) if label is not None else self.slices_with_any()
+        if direction > 0:
+            i = np.searchsorted(zs, z_index, side='right')
+            return int(zs[i]) if i < len(zs) else None
+        i = np.searchsorted(zs, z_index, side='left') - 1
+        return int(zs[i]) if i >= 0 else None
+
+    def slices_with_any(self):
+        with self._lock:
+            self._refresh()
+            return np.flatnonzero(self.counts[:, 1:].any(axis=1))
+
+    def bbox(self, z_index, label=None):
+        """
+        Bounding box (y0, y1, x0, x1) of `label` on slice `z_index`, or of all labels when
+        `label` is None; None if absent.
+        """
+        with self._lock:
+            self._refresh()
+            if label is not None:
+                column = self._columns.get(int(label))
+                if column is None or not self.counts[z_index, column]:
+                    return None
+                return tuple(int(v) for v in self.bboxes[z_index, column])
+            present = self.counts[z_index, 1:] > 0
+            if not present.any():
+                return None
+            b = self.bboxes[z_index, 1:][present]
+        return int(b[:, 0].min()), int(b[:, 1].max()), int(b[:, 2].min()), int(b[:, 3].max())
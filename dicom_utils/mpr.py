@@ -0,0 +1,285 @@
+"""
+Multi-planar reformat: axial, coronal and sagittal planes of a (z, y, x) volume in one frame.
+
+Non-axial planes of a C-ordered volume are strided reads (`img[:, y, :]` touches one row of
+every slice). The slicer therefore builds, on first use and on a background thread, copies
+of the volume and mask with the plane's axis first, so scrolling coronal or sagittal slices
+reads contiguous memory like axial scrolling does; until a copy is ready the strided view is
+used. Planes are resampled to square pixels from `spacing` (z, y, x), and laid out side by
+side as described by `MPRSlicer.layout()`, a WindowMeta that UICanvas maps events with.
+"""
+import threading
+
+import numpy as np
+from PIL import Image as PILImage, ImageDraw
+
+from .canvas_utils import WindowMeta
+from .dicom_utils import DicomSlicer, label_outline
+
+PLANES = ('axial', 'coronal', 'sagittal')
+# plane -> (sliced axis, row axis, column axis) of the (z, y, x) volume
+PLANE_AXES = {'axial': (0, 1, 2), 'coronal': (1, 0, 2), 'sagittal': (2, 0, 1)}
+# plane -> state key of its slice index
+PLANE_INDEX = {'axial': 'z_index', 'coronal': 'y_index', 'sagittal': 'x_index'}
+# plane -> WindowMeta name
+PLANE_NAMES = {'axial': 'Slice_Axial', 'coronal': 'Slice_Coronal', 'sagittal': 'Slice_Sagittal'}
+
+
+def _axis_map(n_in, n_out):
+    """
+    Sampling of an axis of `n_in` voxels at `n_out` pixels: nearest indices, and the lower
+    index, upper index and 8-bit weight of the upper one for linear interpolation.
+    """
+    centres = (np.arange(n_out) + 0.5) * n_in / n_out
+    nearest = np.minimum(np.floor(centres).astype(np.intp), n_in - 1)
+    pos = np.clip(centres - 0.5, 0, n_in - 1)
+    lo = np.floor(pos).astype(np.intp)
+    hi = np.minimum(lo + 1, n_in - 1)
+    weight = np.round((pos - lo) * 256).astype(np.uint16)
+    return nearest, lo, hi, weight
+
+
+def _lerp_rows(arr, lo, hi, weight):
+    """Linear interpolation of uint8 rows `lo`/`hi` of `arr` (8-bit fixed point)."""
+    w = weight.reshape((-1,) + (1,) * (arr.ndim - 1))
+    a = arr[lo].astype(np.uint16)
+    b = arr[hi].astype(np.uint16)
+    return ((a * (256 - w) + b * w + 128) >> 8).astype(np.uint8)
+
+
+class MPRSlicer(DicomSlicer):
+    """
+    DicomSlicer showing the planes in `planes` through the point (`z_index`, `y_index`, `x_index`)
+    of the state, with an optional crosshair at that point:
+
+        slicer = MPRSlicer(ct, mask, spacing=(2.5, 0.7, 0.7))
+        slicer.update_state(y_index=200)
+        frame = slicer.get_image()
+        meta = slicer.layout()                        # WindowMeta of the frame
+        slicer.voxel_at('coronal', x, y)              # (z, y, x) under a coronal view pixel
+
+    `interpolation='linear'` smooths stretched image axes (labels are always nearest).
+    `transposed_copies=False` keeps memory at one copy of the data, at the cost of strided reads.
+    The `lod` and `viewport` state entries are not used.
+    """
+    # Coronal/sagittal planes read every mask slice
+    slice_local_mask = False
+
+    def __init__(self, image_array, mask=None, origin=None, spacing=None, label_to_organ=None, organ_to_color=None,
+                 planes=PLANES, interpolation='linear', transposed_copies=True, gap=2,
+                 crosshair_color=(255, 200, 0)):
+        super().__init__(image_array, mask=mask, origin=origin, spacing=spacing,
+                         label_to_organ=label_to_organ, organ_to_color=organ_to_color)
+        unknown = set(planes) - set(PLANES)
+        if unknown:
+            raise ValueError(f"unknown planes {sorted(unknown)}, expected some of {PLANES}")
+        self.planes = tuple(planes)
+        self.interpolation = interpolation
+        self.transposed_copies = transposed_copies
+        self.gap = gap
+        self.crosshair_color = crosshair_color
+        depth, height, width = self.img.shape[:3]
+        self.state.update(z_index=depth // 2, y_index=height // 2, x_index=width // 2, crosshair=True)
+        # (plane, 'img'/'mask') -> volume with the plane's axis first; see `_plane_volume`
+        self._copies = {}
+        self._building = set()
+        self._copies_lock = threading.Lock()
+        self._init_geometry()
+
+    def _init_geometry(self):
+        shape = self.img.shape[:3]
+        spacing = tuple(float(s) for s in self.spacing)
+        self._maps = {}
+        self._sizes = {}
+        for plane in PLANES:
+            _, r, c = PLANE_AXES[plane]
+            pixel = min(spacing[r], spacing[c])
+            out = (max(1, round(shape[r] * spacing[r] / pixel)), max(1, round(shape[c] * spacing[c] / pixel)))
+            self._sizes[plane] = out
+            self._maps[plane] = (_axis_map(shape[r], out[0]), _axis_map(shape[c], out[1]))
+
+    def set_data(self, image, mask=None):
+        super().set_data(image, mask)
+        with self._copies_lock:
+            self._copies.clear()
+        depth, height, width = self.img.shape[:3]
+        self.state.update(y_index=min(self.state['y_index'], height - 1), x_index=min(self.state['x_index'], width - 1))
+        self._init_geometry()
+
+    def mark_mask_edited(self, z_index=None, bbox=None):
+        super().mark_mask_edited(z_index, bbox)
+        with self._copies_lock:
+            for plane in ('coronal', 'sagittal'):
+                copy = self._copies.get((plane, 'mask'))
+                if copy is None:
+                    continue
+                if z_index is None or bbox is None:
+                    del self._copies[(plane, 'mask')]
+                    continue
+                # Patch the edited box into the copy instead of rebuilding it
+                y0, y1, x0, x1 = bbox
+                block = np.asarray(self.mask[z_index, y0:y1, x0:x1])
+                if plane == 'coronal':
+                    copy[y0:y1, z_index, x0:x1] = block
+                else:
+                    copy[x0:x1, z_index, y0:y1] = block.T
+        # Every frame shows all three planes, so any slice's frame may have changed
+        if self.frame_cache is not None:
+            self.frame_cache.clear()
+
+    # --- Plane data ---
+    def _build_copy(self, plane, kind, version):
+        src = self.img if kind == 'img' else self.mask
+        axis = PLANE_AXES[plane][0]
+        depth = src.shape[0]
+        order = (1, 0, 2) if axis == 1 else (2, 0, 1)
+        out = np.empty(tuple(src.shape[i] for i in order), dtype=src.dtype)
+        for z0 in range(0, depth, 16):
+            out[:, z0:z0 + 16] = np.asarray(src[z0:z0 + 16]).transpose(order)
+        with self._copies_lock:
+            self._building.discard((plane, kind))
+            # Edits or new data while copying would be missing from the copy
+            if self._version(kind) == version:
+                self._copies[(plane, kind)] = out
+
+    def _version(self, kind):
+        return self.data_version if kind == 'img' else (self.data_version, self.mask_version)
+
+    def _plane_volume(self, plane, kind):
+        """Transposed copy of the image/mask for `plane`, or None while it is (being) built."""
+        if plane == 'axial' or not self.transposed_copies:
+            return None
+        key = (plane, kind)
+        with self._copies_lock:
+            copy = self._copies.get(key)
+            if copy is not None or key in self._building:
+                return copy
+            self._building.add(key)
+            version = self._version(kind)
+        threading.Thread(target=self._build_copy, args=(plane, kind, version), daemon=True,
+                         name=f'liteviz-mpr-{plane}-{kind}').start()
+        return None
+
+    def plane_slice(self, plane, index, kind='img'):
+        """2D image (`kind='img'`) or mask slice `index` of `plane`, rows and columns as displayed."""
+        src = self.img if kind == 'img' else self.mask
+        if plane == 'axial':
+            return np.asarray(src[index])
+        copy = self._plane_volume(plane, kind)
+        if copy is not None:
+            return copy[index]
+        return np.asarray(src[:, index, :] if plane == 'coronal' else src[:, :, index])
+
+    def plane_size(self, plane):
+        """Displayed (height, width) of `plane` after resampling to square pixels."""
+        return self._sizes[plane]
+
+    def _resample(self, plane, arr, linear):
+        (rn, rlo, rhi, rw), (cn, clo, chi, cw) = self._maps[plane]
+        h, w = arr.shape[:2]
+        out_h, out_w = self._sizes[plane]
+        if linear and out_h != h:
+            arr = _lerp_rows(arr, rlo, rhi, rw)
+        elif out_h != h:
+            arr = arr[rn]
+        if linear and out_w != w:
+            arr = _lerp_rows(arr.T, clo, chi, cw).T
+        elif out_w != w:
+            arr = arr[:, cn]
+        return np.ascontiguousarray(arr)
+
+    def render_plane(self, plane, state=None):
+        """PIL image of `plane` at the state's slice index, resampled to `plane_size(plane)`."""
+        state = self.state if state is None else state
+        index = state[PLANE_INDEX[plane]]
+        timer = self.timer
+        gray = labels = None
+        if not state['only_mask']:
+            with timer.stage('extract'):
+                img_slice = self.plane_slice(plane, index)
+            with timer.stage('window'):
+                gray = self.window_lut(img_slice, hu=state['hu'])
+            with timer.stage('resample'):
+                gray = self._resample(plane, gray, self.interpolation == 'linear')
+        if self.mask is not None and state['mask_on']:
+            with timer.stage('extract_mask'):
+                labels = self.plane_slice(plane, index, kind='mask')
+                if state.get('overlay_mode', 'fill') == 'outline':
+                    labels = label_outline(labels)
+                labels = self._resample(plane, labels, False)
+        return self.compose(gray, labels, state, self._sizes[plane])
+
+    # --- Layout and coordinates ---
+    def layout(self):
+        """WindowMeta of the frame: one subwindow per plane, left to right, named as in PLANE_NAMES."""
+        subwindows = []
+        x = 0
+        for plane in self.planes:
+            h, w = self._sizes[plane]
+            subwindows.append(WindowMeta(width=w, height=h, offset_x=x, offset_y=0, name=PLANE_NAMES[plane]))
+            x += w + self.gap
+        height = max(sub.height for sub in subwindows)
+        return WindowMeta(width=x - self.gap, height=height, offset_x=0, offset_y=0, name='MPR',
+                          subwindows=subwindows)
+
+    def plane_of(self, name):
+        """Plane for a WindowMeta subwindow name (e.g. UICanvas' `planeId`), or None."""
+        for plane, plane_name in PLANE_NAMES.items():
+            if plane_name == name:
+                return plane
+        return None
+
+    def voxel_at(self, plane, x, y, state=None):
+        """Voxel (z, y, x) under pixel (x, y) of the `plane` view (local coordinates)."""
+        st = self.state if state is None else state
+        (rn, _, _, _), (cn, _, _, _) = self._maps[plane]
+        h, w = self._sizes[plane]
+        row = rn[min(max(int(y), 0), h - 1)]
+        col = cn[min(max(int(x), 0), w - 1)]
+        voxel = [st['z_index'], st['y_index'], st['x_index']]
+        _, r, c = PLANE_AXES[plane]
+        voxel[r], voxel[c] = int(row), int(col)
+        return tuple(voxel)
+
+    def _to_display(self, plane, axis_index, value):
+        # Display coordinate of the centre of voxel `value` along the view's row (0) or column (1) axis
+        n_out = self._sizes[plane][axis_index]
+        n_in = self.img.shape[PLANE_AXES[plane][1 + axis_index]]
+        return int((value + 0.5) * n_out / n_in)
+
+    # --- Frame ---
+    def frame_key(self, state=None):
+        st = self.state if state is None else state
+        return super().frame_key(st) + (st['y_index'], st['x_index'], st.get('crosshair', False), self.planes)
+
+    def get_image(self, state=None, live=False):
+        """All planes of `self.planes` side by side, as laid out by `layout()` (`live` is not used)."""
+        state = self.state if state is None else state
+        meta = self.layout()
+        views = [self.render_plane(plane, state) for plane in self.planes]
+        crosshair = state.get('crosshair', False)
+        mode = 'L' if not crosshair and all(v.mode == 'L' for v in views) else 'RGBA'
+        frame = PILImage.new(mode, (meta.width, meta.height), 0 if mode == 'L' else (0, 0, 0, 255))
+        with self.timer.stage('layout'):
+            for plane, view, sub in zip(self.planes, views, meta.subwindows):
+                frame.paste(view if view.mode == mode else view.convert(mode), (sub.offset_x, sub.offset_y))
+            if crosshair:
+                draw = ImageDraw.Draw(frame)
+                voxel = (state['z_index'], state['y_index'], state['x_index'])
+                color = tuple(self.crosshair_color) + (255,)
+                for plane, sub in zip(self.planes, meta.subwindows):
+                    _, r, c = PLANE_AXES[plane]
+                    row = sub.offset_y + self._to_display(plane, 0, voxel[r])
+                    col = sub.offset_x + self._to_display(plane, 1, voxel[c])
+                    draw.line([(sub.offset_x, row), (sub.offset_x + sub.width - 1, row)], fill=color)
+                    draw.line([(col, sub.offset_y), (col, sub.offset_y + sub.height - 1)], fill=color)
+        return frame
+
+    def wait_for_copies(self, timeout=None):
+        """Build (if needed) and wait for the transposed copies of the shown planes, e.g. before a benchmark."""
+        for plane in self.planes:
+            for kind in ('img', 'mask') if self.mask is not None else ('img',):
+                self._plane_volume(plane, kind)
+        for thread in threading.enumerate():
+            if thread.name.startswith('liteviz-mpr-'):
+                thread.join(timeout)
@@ -0,0 +1,234 @@
+"""
+N-dimensional volumes (time, channel, z, y, x, ...) with named axes.
+
+NDSlicer shows the (y, x) planes of an N-D array. `z_index` selects along the slice axis,
+and every other axis has its own `<name>_index` in the state (e.g. `t_index`). The rendering
+code sees a 3D (z, y, x) view with those indices fixed. For numpy arrays and memory maps this
+is a strided view, so nothing is copied and only the displayed plane is read. Other lazy
+arrays (h5py, zarr, ...) are wrapped in an AxisView that indexes the parent per request.
+"""
+import copy
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .dicom_utils import DicomSlicer
+from .history import EditHistory
+
+
+class AxisView:
+    """(z, y, x) view of an N-D array-like `parent`, with the axes in `fixed` ({position: index}) held constant."""
+    def __init__(self, parent, fixed, order):
+        self.parent = parent
+        self.fixed = dict(fixed)
+        self.order = tuple(order)  # parent positions of z, y, x
+        self.shape = tuple(parent.shape[p] for p in self.order)
+        self.dtype = parent.dtype
+        self.ndim = 3
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _key(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (3 - len(key))
+        full = [slice(None)] * self.parent.ndim
+        for pos, index in self.fixed.items():
+            full[pos] = index
+        for pos, k in zip(self.order, key):
+            full[pos] = k
+        return tuple(full)
+
+    def __getitem__(self, key):
+        return np.asarray(self.parent[self._key(key)])
+
+    def __setitem__(self, key, value):
+        self.parent[self._key(key)] = value
+
+    def __array__(self, dtype=None, copy=None):
+        out = np.asarray(self.parent[self._key(slice(None))])
+        return out.astype(dtype) if dtype is not None else out
+
+
+def axis_view(parent, axes, fixed, slice_axis, display_axes=('y', 'x')):
+    """
+    (z, y, x) view of `parent` (axes named by `axes`) along `slice_axis` with the named indices
+    in `fixed` held constant: a numpy view for arrays and memory maps, an AxisView otherwise.
+    """
+    order = [axes.index(slice_axis)] + [axes.index(a) for a in display_axes]
+    fixed_pos = {axes.index(name): int(i) for name, i in fixed.items() if name in axes}
+    if isinstance(parent, np.ndarray):
+        key = tuple(fixed_pos.get(p, slice(None)) for p in range(parent.ndim))
+        view = parent[key]
+        # Remaining axes keep their relative order; move them to (z, y, x)
+        remaining = [p for p in range(parent.ndim) if p not in fixed_pos]
+        return np.moveaxis(view, [remaining.index(p) for p in order], [0, 1, 2])
+    return AxisView(parent, fixed_pos, order)
+
+
+class NDSlicer(DicomSlicer):
+    """
+        slicer = NDSlicer(perfusion, axes='tzyx', mask=mask)    # mask: same axes, or (z, y, x) shared
+        slicer.update_state(t_index=12, z_index=40)
+        slicer.get_image()
+
+    The display axes are the last two names in `axes`. The slice axis (`z_index`) is 'z' when
+    present, otherwise the last other axis. `cine_axis` (default: 't' if present) is the axis
+    that DicomWidget plays back with preloading. Edits, undo history and the label index of a
+    mask with the same axes are kept per combination of the other indices.
+
+    Frames are always rendered by a view slicer fixed to the indices of the requested state
+    (see `_view_slicer`), so worker threads never see `img`/`mask` change while the displayed
+    indices are switched.
+    """
+    def __init__(self, image_array, axes='tzyx', mask=None, origin=None, spacing=None,
+                 label_to_organ=None, organ_to_color=None, cine_axis='t', max_views=8):
+        self.max_views = max_views
+        self._cine_request = cine_axis
+        self._views = OrderedDict()  # extras -> slicer rendering the frames of those indices (see `_view_slicer`)
+        self._views_lock = threading.Lock()
+        self._set_volume(image_array, axes, mask)
+        img, mask_view = self._select_views(self._extras)
+        super().__init__(img, mask=mask_view, origin=origin, spacing=spacing,
+                         label_to_organ=label_to_organ, organ_to_color=organ_to_color)
+        self._reset_axis_state()
+
+    def _set_volume(self, image_array, axes, mask):
+        axes = tuple(axes)
+        if len(axes) != image_array.ndim or len(set(axes)) != len(axes):
+            raise ValueError(f"axes {axes} do not name the {image_array.ndim} dimensions of the image")
+        if len(axes) < 3:
+            raise ValueError("NDSlicer needs at least one axis besides the two display axes")
+        if mask is None:
+            mask_axes = None
+        elif mask.ndim == len(axes):
+            mask_axes = axes
+        elif mask.ndim == 3:
+            mask_axes = None  # set below, once the slice axis is known
+        else:
+            raise ValueError(f"mask must have the image's axes {axes} or be 3D, got shape {mask.shape}")
+        self.volume = image_array
+        self.axes = axes
+        self.display_axes = axes[-2:]
+        others = axes[:-2]
+        self.slice_axis = 'z' if 'z' in others else others[-1]
+        self.extra_axes = tuple(a for a in others if a != self.slice_axis)
+        self.axis_sizes = {a: image_array.shape[axes.index(a)] for a in self.extra_axes}
+        self.cine_axis = self._cine_request if self._cine_request in self.extra_axes else None
+        if mask is not None and mask_axes is None:
+            mask_axes = (self.slice_axis,) + self.display_axes
+        self.mask_volume, self.mask_axes = mask, mask_axes
+        self._extras = tuple(0 for _ in self.extra_axes)
+        self._per_view = {}  # extras -> (history, label index) while another combination is selected
+        with self._views_lock:
+            self._views.clear()
+
+    def _reset_axis_state(self):
+        for a in self.extra_axes:
+            self.state.update({f'{a}_index': 0, f'{a}_index_min': 0, f'{a}_index_max': self.axis_sizes[a] - 1})
+
+    def extras(self, state=None):
+        """Indices of the extra (non-slice, non-display) axes in `state`."""
+        st = self.state if state is None else state
+        return tuple(st.get(f'{a}_index', 0) for a in self.extra_axes)
+
+    def _select_views(self, extras):
+        fixed = dict(zip(self.extra_axes, extras))
+        img = axis_view(self.volume, self.axes, fixed, self.slice_axis, self.display_axes)
+        mask = None
+        if self.mask_volume is not None:
+            mask = axis_view(self.mask_volume, self.mask_axes, fixed, self.slice_axis, self.display_axes)
+        return img, mask
+
+    @property
+    def _mask_varies(self):
+        return self.mask_axes is not None and len(self.mask_axes) > 3
+
+    def update_state(self, **kwargs):
+        super().update_state(**kwargs)
+        extras = self.extras()
+        if extras != self._extras:
+            self._switch(extras)
+
+    def _switch(self, extras):
+        """Point img/mask (edited through `edit_mask`) at the planes of `extras`, keeping per-combination mask state."""
+        with self._views_lock:
+            if self._mask_varies:
+                self._per_view[self._extras] = (self.history, self._label_index)
+                self.history, self._label_index = self._per_view.pop(extras, (EditHistory(), None))
+            self.img, self.mask = self._select_views(extras)
+            self._extras = extras
+
+    def set_data(self, image, mask=None, axes=None):
+        """
+        Show another N-D volume (and mask), with the same axis names unless `axes` is given.
+        The extra axes start again at index 0; edit histories of the previous volume are dropped.
+        """
+        self._set_volume(image, self.axes if axes is None else axes, mask)
+        img, mask_view = self._select_views(self._extras)
+        super().set_data(img, mask_view)
+        self._reset_axis_state()
+
+    def frame_key(self, state=None):
+        key = super().frame_key(state)
+        # Before data/mask versions: the live frame key drops the last entry
+        return key[:-2] + (self.extras(state),) + key[-2:]
+
+    def _label_index_of(self, extras):
+        # Called with the views lock held
+        if extras == self._extras or not self._mask_varies:
+            return self._label_index
+        return self._per_view.get(extras, (None, None))[1]
+
+    def _view_slicer(self, extras):
+        """
+        Slicer over the planes of `extras`: its img/mask never change, and it shares the data,
+        palette and settings of this slicer. Views are kept for the `max_views` latest indices.
+        """
+        with self._views_lock:
+            view = self._views.get(extras)
+            if view is not None:
+                self._views.move_to_end(extras)
+                # Settings that can change after the view was made
+                view.palette, view.timer = self.palette, self.timer
+                if view._label_index is None:
+                    view._label_index = self._label_index_of(extras)
+                return view
+            view = copy.copy(self)
+            view.state = dict(self.state)
+            view.img, view.mask = self._select_views(extras)
+            view._extras = extras
+            view._views = None  # a view renders its own frames
+            view._per_view = None
+            view.history = None
+            view.frame_cache = None
+            view._live_frame = None
+            view._live_lock = threading.Lock()
+            view._label_index = self._label_index_of(extras)
+            view._outlines = OrderedDict()
+            view._outlines_lock = threading.Lock()
+            view._slice_mask_versions = dict(self._slice_mask_versions)
+            view._slab = None
+            self._views[extras] = view
+            # The view of the displayed indices holds the live frame, so it is never evicted
+            for old in [e for e in self._views if e != self._extras][:max(0, len(self._views) - self.max_views)]:
+                del self._views[old]
+        return view
+
+    def mark_mask_edited(self, z_index=None, bbox=None):
+        super().mark_mask_edited(z_index, bbox)
+        if self._views is None:
+            return
+        # Views showing the edited planes: those of the displayed indices, or all for a shared 3D mask
+        with self._views_lock:
+            views = [v for e, v in self._views.items() if e == self._extras or not self._mask_varies]
+        for view in views:
+            view.mark_mask_edited(z_index, bbox)
+
+    def get_image(self, state=None, live=False):
+        if self._views is None:
+            return super().get_image(state, live=live)
+        state = self.state if state is None else state
+        return self._view_slicer(self.extras(state)).get_image(state, live=live)
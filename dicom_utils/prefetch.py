@@ -0,0 +1,90 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .frame_cache import FrameCache
+
+
+class SlicePrefetcher:
+    """
+    Renders and encodes the slices ahead of the current one on a thread pool and stores
+    them in the slicer's frame cache. Follows the direction of the last scroll.
+    `axis` is the state index to look ahead on (e.g. 't_index' for cine playback of an
+    NDSlicer); with `wrap=True` the look-ahead continues from the start, as a looping cine does.
+
+    Every job works on a snapshot of `slicer.state`, so workers never read the live state.
+    Call `notify()` after each displayed frame.
+    """
+    def __init__(self, slicer, viewer, depth=4, workers=2, axis='z_index', wrap=False):
+        if slicer.frame_cache is None:
+            slicer.frame_cache = FrameCache()
+        self.slicer = slicer
+        self.viewer = viewer
+        self.depth = depth
+        self.axis = axis
+        self.wrap = wrap
+        self.direction = 1
+        self._last_z = None
+        self._context = None
+        self._generation = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='liteviz-prefetch')
+
+    def _context_of(self, state):
+        # Everything in the frame key except the index we look ahead on
+        return self.slicer.frame_key(dict(state, **{self.axis: None}))
+
+    def notify(self, state=None):
+        """Schedule the next `depth` slices after the one that was just displayed (`state`)."""
+        state = dict(self.slicer.state if state is None else state)
+        z = state[self.axis]
+        if self._last_z is not None and z != self._last_z:
+            self.direction = 1 if z > self._last_z else -1
+        self._last_z = z
+
+        context = self._context_of(state)
+        with self._lock:
+            # Slices queued for an older position are no longer "ahead"; restart from here
+            for fut in self._pending:
+                fut.cancel()
+            self._pending = []
+            if context != self._context:
+                # Window or mask settings changed: results of running jobs are stale
+                self._context = context
+                self._generation += 1
+            generation = self._generation
+
+            cache = self.slicer.frame_cache
+            lo, hi = state[self.axis + '_min'], state[self.axis + '_max']
+            for k in range(1, self.depth + 1):
+                zk = z + k * self.direction
+                if self.wrap:
+                    zk = lo + (zk - lo) % (hi - lo + 1)
+                elif not lo <= zk <= hi:
+                    break
+                job_state = dict(state, **{self.axis: zk})
+                # Key is fixed now: if the data changes while rendering, the result is simply unreachable
+                key = self.slicer.frame_key(job_state) + self.viewer.encoder_key
+                if key in cache:
+                    continue
+                self._pending.append(self._pool.submit(self._render, job_state, key, generation))
+
+    def _render(self, state, key, generation):
+        if generation != self._generation:
+            return
+        data = self.viewer.encode(self.slicer.get_image(state))
+        if generation == self._generation:
+            self.slicer.frame_cache.put(key, data)
+
+    def cancel(self):
+        """Drop queued jobs and discard results of the running ones."""
+        with self._lock:
+            for fut in self._pending:
+                fut.cancel()
+            self._pending = []
+            self._generation += 1
+            self._context = None
+
+    def shutdown(self):
+        self.cancel()
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,93 @@
+import time
+import threading
+from collections import deque
+from contextlib import nullcontext
+
+import numpy as np
+
+_NULL_STAGE = nullcontext()
+
+
+class _Stage:
+    __slots__ = ('timer', 'name', 't0')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, time.perf_counter() - self.t0)
+        return False
+
+
+class StageTimer:
+    """
+    Rolling per-stage timings of the render pipeline (last `window` samples per stage).
+
+        timer = StageTimer()
+        with timer.stage('encode'):
+            ...
+        timer.stats()   # {'encode': {'count', 'p50_ms', 'p95_ms', 'max_ms'}, ..., 'fps': ...}
+
+    When disabled, `stage()` returns a shared no-op context manager, so instrumented code
+    costs one attribute lookup and one call per stage.
+    """
+    def __init__(self, window=256, enabled=True):
+        self.window = window
+        self.enabled = enabled
+        self._samples = {}
+        self._frames = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def add(self, name, seconds):
+        samples = self._samples.get(name)
+        if samples is None:
+            with self._lock:
+                samples = self._samples.setdefault(name, deque(maxlen=self.window))
+        samples.append(seconds)
+
+    def frame_done(self):
+        """Mark one frame as displayed (used for the frames-per-second estimate)."""
+        if self.enabled:
+            self._frames.append(time.perf_counter())
+
+    def fps(self):
+        frames = list(self._frames)
+        if len(frames) < 2 or frames[-1] == frames[0]:
+            return 0.0
+        return (len(frames) - 1) / (frames[-1] - frames[0])
+
+    def stats(self):
+        out = {}
+        for name, samples in list(self._samples.items()):
+            ms = np.array(samples, dtype=np.float64) * 1000
+            if ms.size == 0:
+                continue
+            p50, p95 = np.percentile(ms, [50, 95])
+            out[name] = {'count': int(ms.size), 'p50_ms': float(p50), 'p95_ms': float(p95), 'max_ms': float(ms.max())}
+        out['fps'] = self.fps()
+        return out
+
+    def summary(self):
+        """One-line p50 summary, e.g. for a status label."""
+        stats = self.stats()
+        parts = [f"{name} {s['p50_ms']:.1f}" for name, s in stats.items() if name != 'fps']
+        return f"{stats['fps']:.1f} fps | " + ' '.join(parts) + ' ms'
+
+    def reset(self):
+        with self._lock:
+            self._samples = {}
+            self._frames.clear()
+
+
+# Shared disabled timer: the default for slicers and viewers
+NULL_TIMER = StageTimer(window=1, enabled=False)
@@ -0,0 +1,248 @@
+"""
+Multi-resolution pyramid for very large 2D (RGB or grayscale uint8) images.
+
+Level 0 is the full image, each further level halves both sides (2x2 mean). Frames are
+assembled from fixed-size tiles of the level that matches the current zoom, read through
+a TileCache, so a 20k x 20k slide costs per frame what the display needs, not what the
+image holds. The smallest level is kept in memory and is always available as an overview.
+
+    pyr = ImagePyramid.build(rgb, directory='slide.pyr')   # or ImagePyramid.load('slide.pyr')
+    slicer = PyramidSlicer(pyr)
+"""
+import glob
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .dicom_utils import DicomSlicer
+from .viewport import Viewport, sample_indices
+
+
+def _halve(src, out, rows=512):
+    """2x2 mean of `src` into `out` (ceil-sized; odd edges repeat their last row/column), in row strips."""
+    h, w = src.shape[:2]
+    for r0 in range(0, h, rows):
+        block = np.asarray(src[r0:r0 + rows], dtype=np.uint16)
+        if block.shape[0] % 2:
+            block = np.concatenate([block, block[-1:]])
+        if w % 2:
+            block = np.concatenate([block, block[:, -1:]], axis=1)
+        bh, bw = block.shape[:2]
+        summed = block.reshape((bh // 2, 2, bw // 2, 2) + block.shape[2:]).sum(axis=(1, 3))
+        out[r0 // 2:r0 // 2 + bh // 2] = ((summed + 2) // 4).astype(np.uint8)
+
+
+class ImagePyramid:
+    """List of levels (arrays or memory maps), level 0 the full resolution image."""
+    def __init__(self, levels):
+        self.levels = list(levels)
+        # The coarsest level is small; keep it in memory as the always-ready overview
+        self.levels[-1] = np.ascontiguousarray(self.levels[-1])
+
+    def __len__(self):
+        return len(self.levels)
+
+    @property
+    def shape(self):
+        return self.levels[0].shape
+
+    @classmethod
+    def build(cls, image, directory=None, min_size=256):
+        """
+        Downsample `image` (H, W[, C] uint8) until the longer side is <= `min_size`. With
+        `directory`, levels are written there as `level_N.npy` (memory-mapped, reusable with `load`).
+        """
+        image = np.asarray(image) if not hasattr(image, 'shape') else image
+        if np.dtype(image.dtype) != np.uint8:
+            raise TypeError(f"pyramid levels are uint8, got {image.dtype}")
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            np.save(os.path.join(directory, 'level_0.npy'), np.asarray(image))
+            image = np.load(os.path.join(directory, 'level_0.npy'), mmap_mode='r')
+        levels = [image]
+        while max(levels[-1].shape[:2]) > min_size:
+            src = levels[-1]
+            shape = ((src.shape[0] + 1) // 2, (src.shape[1] + 1) // 2) + src.shape[2:]
+            if directory is not None:
+                fn = os.path.join(directory, f'level_{len(levels)}.npy')
+                out = np.lib.format.open_memmap(fn, mode='w+', dtype=np.uint8, shape=shape)
+            else:
+                out = np.empty(shape, dtype=np.uint8)
+            _halve(src, out)
+            if directory is not None:
+                out.flush()
+                out = np.load(fn, mmap_mode='r')
+            levels.append(out)
+        return cls(levels)
+
+    @classmethod
+    def load(cls, directory):
+        fns = glob.glob(os.path.join(directory, 'level_*.npy'))
+        if not fns:
+            raise FileNotFoundError(f"no pyramid levels in {directory}")
+        fns.sort(key=lambda fn: int(os.path.basename(fn)[6:-4]))
+        return cls([np.load(fn, mmap_mode='r') for fn in fns])
+
+
+class TileCache:
+    """Bounded LRU of decoded tiles (arrays), keyed by (level, tile_y, tile_x)."""
+    def __init__(self, max_bytes=256 * 2**20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self._tiles
+
+    def get(self, key):
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is None:
+                self.misses += 1
+                return None
+            self._tiles.move_to_end(key)
+            self.hits += 1
+            return tile
+
+    def put(self, key, tile):
+        with self._lock:
+            old = self._tiles.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self._tiles[key] = tile
+            self.nbytes += tile.nbytes
+            while self.nbytes > self.max_bytes and len(self._tiles) > 1:
+                _, evicted = self._tiles.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'tiles': len(self._tiles), 'nbytes': self.nbytes, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0}
+
+
+class PyramidSlicer(DicomSlicer):
+    """
+    DicomSlicer for one large 2D image backed by an ImagePyramid: `img` is the level-0 image
+    as a single slice (1, H, W[, C]) and `mask` a (1, H, W) label map, so painting, undo,
+    label colours and overlay modes work as for volumes. `get_image` renders the region in
+    `state['viewport']` (default: the whole image fitted into `max_display`) from the tiles of
+    the level matching the zoom. `hu` is not used.
+    """
+    def __init__(self, image, mask=None, tile_size=256, cache_bytes=256 * 2**20, max_display=1024,
+                 label_to_organ=None, organ_to_color=None):
+        self.pyramid = image if isinstance(image, ImagePyramid) else ImagePyramid.build(image)
+        base = self.pyramid.levels[0][None]
+        if mask is None:
+            # Zero pages are only allocated once painted on
+            mask = np.zeros(base.shape[:3], dtype=np.uint8)
+        elif mask.ndim == 2:
+            mask = mask[None]
+        super().__init__(base, mask=mask, label_to_organ=label_to_organ, organ_to_color=organ_to_color)
+        self.tile_size = tile_size
+        self.tile_cache = TileCache(cache_bytes)
+        h, w = base.shape[1:3]
+        fit = min(1.0, max_display / max(h, w))
+        self.display_size = (max(1, round(h * fit)), max(1, round(w * fit)))
+        self.state['viewport'] = Viewport((h, w), self.display_size).state()
+
+    def _viewport(self, state):
+        viewport = state.get('viewport')
+        if viewport is None:
+            h, w = self.img.shape[1:3]
+            viewport = (0, h, 0, w, h, w)
+        return viewport
+
+    def level_for(self, state=None):
+        """Pyramid level whose resolution matches the zoom of `state` (at least one level pixel per display pixel)."""
+        st = self.state if state is None else state
+        y0, y1, x0, x1, dh, dw = self._viewport(st)
+        scale = max((y1 - y0) / dh, (x1 - x0) / dw) * st.get('lod', 1)
+        level = int(np.floor(np.log2(scale))) if scale >= 1 else 0
+        return min(max(level, 0), len(self.pyramid) - 1)
+
+    def _tile_range(self, level, ys, xs):
+        t = self.tile_size
+        return range(ys.min() // t, ys.max() // t + 1), range(xs.min() // t, xs.max() // t + 1)
+
+    def _level_coords(self, level, ys, xs):
+        arr = self.pyramid.levels[level]
+        return np.minimum(ys >> level, arr.shape[0] - 1), np.minimum(xs >> level, arr.shape[1] - 1)
+
+    def tile(self, level, ty, tx):
+        """Tile (ty, tx) of `level` through the tile cache."""
+        key = (level, ty, tx)
+        tile = self.tile_cache.get(key)
+        if tile is None:
+            t = self.tile_size
+            tile = np.array(self.pyramid.levels[level][ty * t:(ty + 1) * t, tx * t:(tx + 1) * t])
+            self.tile_cache.put(key, tile)
+        return tile
+
+    def level_ready(self, level, state=None):
+        """True when every tile `level` needs for `state` is cached (the coarsest level always is)."""
+        if level == len(self.pyramid) - 1:
+            return True
+        st = self.state if state is None else state
+        ys, xs, _, _ = sample_indices(self._viewport(st), self.img.shape[1:3], st.get('lod', 1))
+        tys, txs = self._tile_range(level, *self._level_coords(level, ys, xs))
+        return all((level, ty, tx) in self.tile_cache for ty in tys for tx in txs)
+
+    def ready_level(self, state=None):
+        """Finest level at or above `level_for(state)` that can be rendered without reading tiles."""
+        level = self.level_for(state)
+        while not self.level_ready(level, state):
+            level += 1
+        return level
+
+    def _sample(self, level, ys, xs):
+        """Level pixels at level-0 rows/columns ys, xs, assembled from the covering tiles."""
+        ly, lx = self._level_coords(level, ys, xs)
+        if level == len(self.pyramid) - 1:
+            return self.pyramid.levels[level][np.ix_(ly, lx)]
+        t = self.tile_size
+        tys, txs = self._tile_range(level, ly, lx)
+        block = np.concatenate([np.concatenate([self.tile(level, ty, tx) for tx in txs], axis=1) for ty in tys])
+        return block[np.ix_(ly - tys.start * t, lx - txs.start * t)]
+
+    def get_image(self, state=None, level=None, live=False):
+        """
+        Render the viewport of `state` at the display size. `level` (default: `level_for(state)`)
+        picks the pyramid level, e.g. a coarser, already cached one for a quick preview.
+        `live` is not used: every frame is resampled from the tiles.
+        """
+        state = self.state if state is None else state
+        viewport = self._viewport(state)
+        ys, xs, y_inside, x_inside = sample_indices(viewport, self.img.shape[1:3], state.get('lod', 1))
+        level = self.level_for(state) if level is None else level
+
+        rgb = labels = None
+        timer = self.timer
+        if not state['only_mask']:
+            with timer.stage('extract'):
+                rgb = self._sample(level, ys, xs)
+        if self.mask is not None and state['mask_on']:
+            with timer.stage('extract_mask'):
+                labels = self.mask[0][np.ix_(ys, xs)]
+        if not (y_inside.all() and x_inside.all()):
+            outside = ~(y_inside[:, None] & x_inside[None, :])
+            if rgb is not None:
+                rgb = rgb.copy()
+                rgb[outside] = 0
+            if labels is not None:
+                labels = np.where(outside, 0, labels).astype(labels.dtype)
+        return self.compose(rgb, labels, state, (len(ys), len(xs)))
+
+
+# Name used in the roadmap
+MicroscopySlicer = PyramidSlicer
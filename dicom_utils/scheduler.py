@@ -0,0 +1,74 @@
+import threading
+
+
+class RenderScheduler:
+    """
+    Latest-wins rendering on a background thread.
+
+    Event handlers update the slicer state synchronously (cheap) and call `request(state)`;
+    a single worker renders only the most recent requested state. Requests that arrive while a
+    frame is being rendered replace each other, so the image never lags behind the mouse by
+    more than one frame. `render(state, interactive)` is any callable, e.g. a `show_frame`
+    wrapper for the widgets or a custom renderer for `UICanvas` consumers.
+    """
+    def __init__(self, render):
+        self.render = render
+        self.requested = 0
+        self.rendered = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_error = None
+        self._pending = None
+        self._busy = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='liteviz-render', daemon=True)
+        self._thread.start()
+
+    def request(self, state, interactive=False):
+        """Queue a render of (a snapshot of) `state`, replacing any request not yet started."""
+        with self._cond:
+            self.requested += 1
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = (dict(state), interactive)
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                state, interactive = self._pending
+                self._pending = None
+                self._busy = True
+            try:
+                self.render(state, interactive)
+            except Exception as e:  # keep the worker alive; the next request may succeed
+                self.errors += 1
+                self.last_error = e
+            with self._cond:
+                self._busy = False
+                self.rendered += 1
+                self._cond.notify_all()
+
+    def wait(self, timeout=None):
+        """Block until every request so far has been rendered or dropped."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending is None and not self._busy, timeout)
+
+    def stats(self):
+        return {
+            'requested': self.requested,
+            'rendered': self.rendered,
+            'dropped': self.dropped,
+            'errors': self.errors,
+        }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._pending = None
+            self._cond.notify_all()
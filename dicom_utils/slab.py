@@ -0,0 +1,117 @@
+"""
+Thick-slab projections (MIP / MinIP / mean) that stay cheap while scrolling.
+
+The slab of slice z covers `thickness` slices centred on z (clipped at the volume ends).
+Moving it by one slice changes only two slices, so:
+
+- mean keeps a running sum of the slab and adds/subtracts the slices that enter/leave it;
+- MIP/MinIP use van Herk/Gil-Werman blocks: the volume is cut into blocks of `thickness`
+  slices and for each block the running max (min) from its first slice forwards and from its
+  last slice backwards is stored. Any slab spans at most two neighbouring blocks, so it is the
+  max of one backward and one forward entry; a block costs about two slice maxima per slice
+  and is computed when a slab first needs it.
+
+Scrolling therefore costs about one or two slice operations per frame instead of `thickness`.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+SLAB_MODES = ('none', 'mip', 'minip', 'mean')
+
+
+def slab_range(z_index, thickness, depth):
+    """Slices [lo, hi) of the slab of `thickness` slices centred on `z_index`."""
+    lo = z_index - (thickness - 1) // 2
+    return max(lo, 0), min(lo + thickness, depth)
+
+
+class SlabProjector:
+    """
+        proj = SlabProjector(volume, 'mip', thickness=20)
+        proj.project(z)     # 2D projection of the slab around slice z
+    """
+    def __init__(self, volume, mode, thickness, max_blocks=4):
+        if mode not in SLAB_MODES[1:]:
+            raise ValueError(f"unknown slab mode {mode!r}, expected one of {SLAB_MODES[1:]}")
+        self.volume = volume
+        self.mode = mode
+        self.thickness = max(1, int(thickness))
+        self.depth = volume.shape[0]
+        self.max_blocks = max_blocks
+        self._reduce = np.maximum if mode == 'mip' else np.minimum
+        self._blocks = OrderedDict()  # block index -> (forward, backward) running extrema
+        self._sum = None  # (lo, hi, running sum) of the last mean slab
+        self._lock = threading.Lock()
+
+    def _slice(self, z):
+        return np.asarray(self.volume[z])
+
+    def project(self, z_index):
+        lo, hi = slab_range(z_index, self.thickness, self.depth)
+        with self._lock:
+            if self.mode == 'mean':
+                return self._mean(lo, hi)
+            return self._extremum(lo, hi)
+
+    # --- mean ---
+    def _mean(self, lo, hi):
+        dtype = self.volume.dtype
+        state = self._sum
+        if state is not None and max(lo, state[0]) < min(hi, state[1]):
+            old_lo, old_hi, total = state
+            # Only the slices entering and leaving the slab are read
+            for z in range(old_lo, lo):
+                total -= self._slice(z)
+            for z in range(hi, old_hi):
+                total -= self._slice(z)
+            for z in range(lo, old_lo):
+                total += self._slice(z)
+            for z in range(old_hi, hi):
+                total += self._slice(z)
+        else:
+            acc = np.int64 if np.dtype(dtype).kind in 'iub' else np.float64
+            total = np.zeros(self.volume.shape[1:], dtype=acc)
+            for z in range(lo, hi):
+                total += self._slice(z)
+        self._sum = (lo, hi, total)
+        mean = total / (hi - lo)
+        if np.dtype(dtype).kind in 'iu':
+            # Back to the image dtype so windowing keeps using the lookup table
+            return np.rint(mean).astype(dtype)
+        return mean.astype(np.float32)
+
+    # --- MIP / MinIP ---
+    def _block(self, b):
+        block = self._blocks.get(b)
+        if block is not None:
+            self._blocks.move_to_end(b)
+            return block
+        t = self.thickness
+        z0, z1 = b * t, min((b + 1) * t, self.depth)
+        planes = np.asarray(self.volume[z0:z1])
+        forward = planes.copy()
+        backward = planes.copy()
+        for i in range(1, len(planes)):
+            self._reduce(forward[i - 1], forward[i], out=forward[i])
+            j = len(planes) - 1 - i
+            self._reduce(backward[j + 1], backward[j], out=backward[j])
+        block = (forward, backward)
+        self._blocks[b] = block
+        while len(self._blocks) > self.max_blocks:
+            self._blocks.popitem(last=False)
+        return block
+
+    def _extremum(self, lo, hi):
+        t = self.thickness
+        b_lo, b_hi = lo // t, (hi - 1) // t
+        if b_lo != b_hi:
+            # Tail of one block and head of the next
+            return self._reduce(self._block(b_lo)[1][lo - b_lo * t], self._block(b_hi)[0][hi - 1 - b_hi * t])
+        block_end = min((b_lo + 1) * t, self.depth)
+        if lo == b_lo * t:
+            return self._block(b_lo)[0][hi - 1 - lo]
+        if hi == block_end:
+            return self._block(b_lo)[1][lo - b_lo * t]
+        return self._reduce.reduce(np.asarray(self.volume[lo:hi]), axis=0)
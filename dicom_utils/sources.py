@@ -0,0 +1,175 @@
+"""
+Lazily loaded volume sources for DicomSlicer.
+
+A source looks like a read-mostly (z, y, x) array: it has `shape`, `dtype` and `ndim` and
+supports `src[z]`, `src[z, y, x]`, `src[z0:z1:step]` and `len(src)`. Only the slices that are
+indexed are read from disk. Writes (mask edits) go to an in-memory copy of the touched slice
+and never modify the files.
+"""
+import glob
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class VolumeSource:
+    """Base class: subclasses implement `_read_slice(z)` and set `shape`/`dtype`."""
+    shape = None
+    dtype = None
+
+    def __init__(self, cache_slices=8):
+        self.cache_slices = cache_slices
+        self._cache = OrderedDict()
+        self._overrides = {}  # z -> edited in-memory copy of the slice
+        self._lock = threading.Lock()
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape)) * np.dtype(self.dtype).itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _read_slice(self, z):
+        raise NotImplementedError
+
+    def get_slice(self, z):
+        z = int(z)
+        if z < 0:
+            z += self.shape[0]
+        if not 0 <= z < self.shape[0]:
+            raise IndexError(f"slice index {z} out of range for depth {self.shape[0]}")
+        if z in self._overrides:
+            return self._overrides[z]
+        with self._lock:
+            data = self._cache.get(z)
+            if data is not None:
+                self._cache.move_to_end(z)
+                return data
+        data = np.asarray(self._read_slice(z))
+        with self._lock:
+            self._cache[z] = data
+            while len(self._cache) > self.cache_slices:
+                self._cache.popitem(last=False)
+        return data
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        zkey, rest = key[0], key[1:]
+        if isinstance(zkey, slice):
+            planes = np.stack([self.get_slice(z)[rest] for z in range(*zkey.indices(self.shape[0]))])
+            return planes
+        return self.get_slice(zkey)[rest] if rest else self.get_slice(zkey)
+
+    def __setitem__(self, key, value):
+        if not isinstance(key, tuple):
+            key = (key,)
+        zkey, rest = key[0], key[1:]
+        zs = range(*zkey.indices(self.shape[0])) if isinstance(zkey, slice) else [int(zkey)]
+        for i, z in enumerate(zs):
+            if z not in self._overrides:
+                self._overrides[z] = np.array(self.get_slice(z))
+            v = value[i] if isinstance(zkey, slice) and np.ndim(value) == len(self.shape) else value
+            if rest:
+                self._overrides[z][rest] = v
+            else:
+                self._overrides[z][...] = v
+
+    def __array__(self, dtype=None, copy=None):
+        # Materialises the whole volume; only meant for small data or explicit conversion
+        out = np.stack([self.get_slice(z) for z in range(self.shape[0])])
+        return out.astype(dtype) if dtype is not None else out
+
+    def __repr__(self):
+        return f"{type(self).__name__}(shape={self.shape}, dtype={np.dtype(self.dtype)})"
+
+
+class SliceDirectorySource(VolumeSource):
+    """One file per slice (`.npy`, or any 2D image PIL can read), sorted by file name."""
+    def __init__(self, directory, pattern='*.npy', cache_slices=8):
+        super().__init__(cache_slices=cache_slices)
+        self.files = sorted(glob.glob(os.path.join(directory, pattern)))
+        if not self.files:
+            raise FileNotFoundError(f"no files matching {pattern!r} in {directory}")
+        first = self._load(self.files[0])
+        self.shape = (len(self.files),) + first.shape
+        self.dtype = first.dtype
+
+    @staticmethod
+    def _load(fn):
+        if fn.endswith('.npy'):
+            return np.load(fn, mmap_mode='r')
+        from PIL import Image
+        return np.asarray(Image.open(fn))
+
+    def _read_slice(self, z):
+        return self._load(self.files[z])
+
+
+class ChunkedSource(VolumeSource):
+    """
+    Volume stored as `meta.json` + `chunk_00000.npy`, `chunk_00001.npy`, ... each holding
+    `chunk_depth` consecutive slices. Chunks are memory-mapped on first use.
+    """
+    def __init__(self, directory, cache_slices=8):
+        super().__init__(cache_slices=cache_slices)
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        self.shape = tuple(meta['shape'])
+        self.dtype = np.dtype(meta['dtype'])
+        self.chunk_depth = meta['chunk_depth']
+        self._chunks = {}
+
+    def _chunk(self, c):
+        chunk = self._chunks.get(c)
+        if chunk is None:
+            chunk = np.load(os.path.join(self.directory, f'chunk_{c:05d}.npy'), mmap_mode='r')
+            self._chunks[c] = chunk
+        return chunk
+
+    def _read_slice(self, z):
+        return self._chunk(z // self.chunk_depth)[z % self.chunk_depth]
+
+    @staticmethod
+    def write(directory, volume, chunk_depth=16):
+        """Write `volume` (array or source) in the chunked layout and return the opened source."""
+        os.makedirs(directory, exist_ok=True)
+        for c, z0 in enumerate(range(0, volume.shape[0], chunk_depth)):
+            np.save(os.path.join(directory, f'chunk_{c:05d}.npy'), np.asarray(volume[z0:z0 + chunk_depth]))
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump({'shape': list(volume.shape), 'dtype': np.dtype(volume.dtype).str, 'chunk_depth': chunk_depth}, f)
+        return ChunkedSource(directory)
+
+
+def open_volume(path, pattern='*.npy'):
+    """
+    Open a volume lazily: a `.npy` file is memory-mapped (copy-on-write, so in-place mask
+    edits stay in memory), a directory with `meta.json` is a ChunkedSource, any other
+    directory a SliceDirectorySource.
+    """
+    path = os.fspath(path)
+    if os.path.isdir(path):
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            return ChunkedSource(path)
+        return SliceDirectorySource(path, pattern=pattern)
+    if path.endswith('.npy'):
+        return np.load(path, mmap_mode='c')
+    raise ValueError(f"don't know how to open {path!r} as a volume")
+
+
+def as_volume(obj):
+    """Pass arrays and sources through; open paths with `open_volume`."""
+    if obj is None or hasattr(obj, 'shape'):
+        return obj
+    if isinstance(obj, (str, os.PathLike)):
+        return open_volume(obj)
+    raise TypeError(f"expected an array, a VolumeSource or a path, got {type(obj).__name__}")
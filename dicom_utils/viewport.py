@@ -0,0 +1,111 @@
+"""
+Zoom/pan viewport: which part of a slice is shown, and at what display size.
+
+The slicer only sees the result of `Viewport.state()`, a `(y0, y1, x0, x1, height, width)`
+tuple stored as `state['viewport']`: the visible source region and the display size it is
+resampled to (see `DicomSlicer.get_image`). None means the whole slice at native size.
+"""
+import numpy as np
+
+
+class Viewport:
+    """
+        vp = Viewport(source_shape=(512, 512), display_size=(512, 512))
+        vp.zoom_at(2, x, y)        # zoom in, keeping display point (x, y) fixed
+        vp.pan(dx, dy)             # move by display pixels
+        slicer.update_state(viewport=vp.state())
+    """
+    def __init__(self, source_shape, display_size=None, max_zoom=32):
+        self.source_shape = tuple(source_shape[:2])
+        self.display_size = tuple(display_size) if display_size is not None else self.source_shape
+        self.max_zoom = max_zoom
+        self.reset()
+
+    def reset(self):
+        self.zoom = 1.0
+        self.center = (self.source_shape[0] / 2, self.source_shape[1] / 2)
+
+    @property
+    def fit_scale(self):
+        """Source pixels per display pixel at zoom 1 (the whole slice fits the display)."""
+        h, w = self.source_shape
+        dh, dw = self.display_size
+        return max(h / dh, w / dw)
+
+    @property
+    def scale(self):
+        """Source pixels per display pixel at the current zoom."""
+        return self.fit_scale / self.zoom
+
+    def region(self):
+        """Visible source region (y0, y1, x0, x1) as floats."""
+        dh, dw = self.display_size
+        s = self.scale
+        cy, cx = self.center
+        return cy - dh * s / 2, cy + dh * s / 2, cx - dw * s / 2, cx + dw * s / 2
+
+    def _clamp(self):
+        # Keep the centre inside the slice, and the whole slice centred when it is smaller than the view
+        h, w = self.source_shape
+        y0, y1, x0, x1 = self.region()
+        cy, cx = self.center
+        half_h, half_w = (y1 - y0) / 2, (x1 - x0) / 2
+        cy = h / 2 if 2 * half_h >= h else min(max(cy, half_h), h - half_h)
+        cx = w / 2 if 2 * half_w >= w else min(max(cx, half_w), w - half_w)
+        self.center = (cy, cx)
+
+    def zoom_at(self, factor, x=None, y=None):
+        """Multiply the zoom by `factor`, keeping display point (x, y) (default: the centre) in place."""
+        dh, dw = self.display_size
+        x = dw / 2 if x is None else x
+        y = dh / 2 if y is None else y
+        sy, sx = self.to_source(x, y)
+        self.zoom = float(np.clip(self.zoom * factor, 1.0, self.max_zoom))
+        s = self.scale
+        self.center = (sy - (y - dh / 2) * s, sx - (x - dw / 2) * s)
+        self._clamp()
+
+    def pan(self, dx, dy):
+        """Move the view so the content follows a drag of (dx, dy) display pixels."""
+        s = self.scale
+        self.center = (self.center[0] - dy * s, self.center[1] - dx * s)
+        self._clamp()
+
+    def to_source(self, x, y):
+        """Source (y, x) floats under display pixel (x, y)."""
+        y0, _, x0, _ = self.region()
+        s = self.scale
+        return y0 + y * s, x0 + x * s
+
+    def is_identity(self):
+        return self.zoom == 1.0 and self.display_size == self.source_shape
+
+    def state(self):
+        """Value for `state['viewport']` (None when the whole slice is shown at native size)."""
+        if self.is_identity():
+            return None
+        y0, y1, x0, x1 = self.region()
+        return (round(y0, 3), round(y1, 3), round(x0, 3), round(x1, 3)) + tuple(int(v) for v in self.display_size)
+
+
+def sample_indices(viewport, shape, lod=1):
+    """
+    Nearest-neighbour source rows and columns for a `state['viewport']` value on a slice of
+    `shape`: one per display pixel (every lod-th display pixel for previews). Returns
+    (ys, xs, y_inside, x_inside); indices are clipped, the masks tell which lie inside the slice.
+    """
+    y0, y1, x0, x1, dh, dw = viewport
+    dh, dw = -(-dh // lod), -(-dw // lod)
+    ys = np.floor(y0 + (np.arange(dh) + 0.5) * (y1 - y0) / dh).astype(np.intp)
+    xs = np.floor(x0 + (np.arange(dw) + 0.5) * (x1 - x0) / dw).astype(np.intp)
+    y_inside = (ys >= 0) & (ys < shape[0])
+    x_inside = (xs >= 0) & (xs < shape[1])
+    return np.clip(ys, 0, shape[0] - 1), np.clip(xs, 0, shape[1] - 1), y_inside, x_inside
+
+
+def display_to_source(viewport, x, y, lod=1):
+    """Integer source (x, y) under display pixel (x, y) of a frame rendered with `viewport`/`lod`."""
+    if viewport is None:
+        return int(x) * lod, int(y) * lod
+    y0, y1, x0, x1, dh, dw = viewport
+    return int(np.floor(x0 + (x * lod + 0.5) * (x1 - x0) / dw)), int(np.floor(y0 + (y * lod + 0.5) * (y1 - y0) / dh))
@@ -10,6 +10,11 @@ setup(
         'Pillow>=8.0.0',
         'numpy>=1.19.0'
     ],
+    entry_points={
+        'console_scripts': [
+            'liteviz-render=dicom_utils.cli:main',
+        ],
+    },
     author='Marcin Kostur',
     description='A package for interactive DICOM visualization',
 )
@@ -0,0 +1,84 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image as PILImage
+
+from dicom_utils import DicomSlicer
+from dicom_utils.dicom_utils import labels_to_rgba
+
+
+def composite_reference(slicer, gray, labels, opacity_factor, overlay_box=None):
+    """The RGBA alpha_composite path the fused kernel replaces."""
+    palette = slicer.palette.copy()
+    palette[:, 3] = (palette[:, 3].astype(np.float32) * opacity_factor).astype(np.uint8)
+    base = PILImage.fromarray(gray).convert('RGBA')
+    if overlay_box is not None:
+        y0, y1, x0, x1 = overlay_box
+        keep = np.zeros(labels.shape, dtype=bool)
+        keep[y0:y1, x0:x1] = True
+        labels = np.where(keep, labels, 0)
+    if labels.dtype.kind not in 'iub':
+        labels = labels.astype(np.intp)
+    overlay = PILImage.fromarray(np.take(palette, labels, axis=0, mode='clip'), 'RGBA')
+    return np.asarray(PILImage.alpha_composite(base, overlay).convert('RGB')).astype(int)
+
+
+def make_case(dtype, seed=0, shape=(37, 53)):
+    rng = np.random.default_rng(seed)
+    gray = rng.integers(0, 256, shape, dtype=np.uint8)
+    slicer = DicomSlicer(np.zeros((1,) + shape, dtype=np.int16))
+    n = len(slicer.palette)
+    # Known labels, plus labels outside the palette
+    labels = rng.integers(0, n + 40, shape).astype(dtype)
+    return slicer, gray, labels
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16, np.int16, np.int32, np.uint32])
+@pytest.mark.parametrize('opacity', [0.0, 0.13, 0.5, 0.99, 1.0])
+def test_blend_matches_alpha_composite(dtype, opacity):
+    slicer, gray, labels = make_case(dtype)
+    out = np.asarray(slicer._blend(gray, labels, opacity)).astype(int)
+    assert np.abs(out - composite_reference(slicer, gray, labels, opacity)).max() <= 1
+
+
+@pytest.mark.parametrize('box', [(0, 0, 0, 0), (5, 20, 7, 30), (0, 37, 0, 53), (36, 37, 52, 53)])
+def test_blend_overlay_box(box):
+    slicer, gray, labels = make_case(np.uint8, seed=1)
+    out = np.asarray(slicer._blend(gray, labels, 0.6, overlay_box=box)).astype(int)
+    assert np.abs(out - composite_reference(slicer, gray, labels, 0.6, box)).max() <= 1
+
+
+def test_blend_labels_beyond_uint8_palette():
+    slicer, gray, _ = make_case(np.uint16, seed=2)
+    labels = np.full(gray.shape, 65535, dtype=np.uint16)
+    labels[::2] = 1
+    out = np.asarray(slicer._blend(gray, labels, 0.5)).astype(int)
+    assert np.abs(out - composite_reference(slicer, gray, labels, 0.5)).max() <= 1
+
+
+def test_get_image_matches_composite_path():
+    rng = np.random.default_rng(3)
+    img = rng.normal(0, 400, (4, 40, 50)).astype(np.int16)
+    mask = rng.integers(0, 20, (4, 40, 50)).astype(np.uint8)
+    slicer = DicomSlicer(img, mask)
+    slicer.update_state(mask_on=True, mask_opacity=70, z_index=2)
+    gray = slicer.window_lut(img[2], hu=slicer.state['hu'])
+    out = np.asarray(slicer.get_image()).astype(int)
+    assert np.abs(out - composite_reference(slicer, gray, mask[2], 0.7)).max() <= 1
+
+
+def test_returned_frames_do_not_change():
+    rng = np.random.default_rng(4)
+    img = rng.normal(0, 400, (3, 32, 32)).astype(np.int16)
+    mask = rng.integers(0, 10, (3, 32, 32)).astype(np.uint8)
+    slicer = DicomSlicer(img, mask)
+    slicer.update_state(mask_on=True)
+    first = slicer.get_image(dict(slicer.state, z_index=0))
+    pixels = np.asarray(first).copy()
+    slicer.get_image(dict(slicer.state, z_index=1))
+    slicer.get_image(dict(slicer.state, z_index=2, mask_opacity=100))
+    assert first.mode == 'RGB'
+    assert np.array_equal(np.asarray(first), pixels)
+    # Frames can be encoded as PNG
+    first.save(io.BytesIO(), format='png')